@@ -5,22 +5,66 @@
 '''
 import os
 
-from sqlalchemy.exc import NoResultFound, InvalidRequestError
-from db_handler import DBConnect
 from encrypt import Encrypt
-from cryptography.fernet import InvalidToken
+from importer import Importer, print_progress
+from backup import export_vault, restore_vault
+import secret_record
+from blind_index import BlindIndex
+from app_finder import AppFinder
+import instrument
+from vault_keys import unlock_secrets, change_secret_password, DATA_KEY
 from getpass import getpass
 
+# SQLAlchemy and cryptography are imported where they are used,
+# like in cli.py, and the database is connected on the first
+# register or login, so the menu shows up without waiting for them
+
+def clear_screen():
+    '''
+        Clears the terminal with ANSI codes instead of 
+        starting a shell for every screen
+    '''
+    if os.name == 'nt' and not os.environ.get('WT_SESSION'):
+        os.system('cls') # old windows console without ANSI
+    else:
+        print("\033[2J\033[H", end="", flush=True)
+
+
+class SecretsLocked(Exception):
+    '''
+        The app names are encrypted and the 
+        secrets could not be unlocked
+    '''
+    def __init__(self):
+        super().__init__("The app names are encrypted, the 2nd password is needed.")
+
+
 class VaultApp:
     def __init__(self):
         self.auth = False
         self.user_id = None
         self.user_salt = None # salt for encrypting the passwords for the apps
-        self.db_connect = DBConnect()
+        self.names_encrypted = False
+        self.finder = None # AppFinder of the session, made on first use
+        self._db_connect = None
+
+    @property
+    def db_connect(self):
+        '''
+            DBConnect made on first use (register or login)
+        '''
+        if self._db_connect is None:
+            from db_handler import DBConnect
+            self._db_connect = DBConnect()
+        return self._db_connect
+
+    @db_connect.setter
+    def db_connect(self, db_connect):
+        self._db_connect = db_connect
 
     def display_title_bar(self):
         # Clears the terminal screen, and displays a title bar.
-        os.system('cls')
+        clear_screen()
 
         print("\t************************")
         print("\t*** Vaulting System  ***")
@@ -53,7 +97,17 @@ class VaultApp:
             if (password != password2):
                 raise ValueError
 
-            self.db_connect.register(username, password)
+            res = self.db_connect.register(username, password)
+
+            if not res:
+                print("")
+                print("Username already in use.")
+                input("")
+                return None
+
+            # the new user is logged in right away
+            self.user_id, self.user_salt = res
+            self.auth = True
 
         except ValueError:
             print("")
@@ -111,6 +165,8 @@ class VaultApp:
 
             if self.auth:
                 break
+
+        self.names_encrypted = self.db_connect.names_encrypted(self.user_id)
             
         self.display_title_bar()
         print("You are authenticated.")
@@ -152,7 +208,10 @@ class VaultApp:
             # update values to be saved to the database
             content['user_id'] = self.user_id
 
-            res = self.db_connect.insert(content) # save to DB
+            res = self.db_connect.insert(content, index=self.name_index()) # save to DB
+
+            if res and self.finder is not None:
+                self.finder.add(res, content['app'], content['username'])
 
             self.display_title_bar()
             if res:
@@ -172,36 +231,53 @@ class VaultApp:
         '''
             This will show a list of the apps and classified information
             But the passwords will not be decrypted
+            The apps are read and shown a page at a time
         '''
         try:
-
-            res = self.db_connect.select(\
-                cols = ['id', 'app', 'username', 'secrets'],  
-                conds = {
-                    'user_id' : self.user_id,
-                },
-            )
-
-            # printing headers
-            options = ["ID", "App", "Username", "Secrets"]
-            for option in options:
-                print( f'{option:15}', end="" )
-            print("") 
-
-            # printing passwords
-            for row in res:
-                app_id, app, username, secrets  = row
-                print(f'{str(app_id):15}', end="")
-                print(f'{str(app):15}{str(username) if username != None else "------":15}', end="")
-                print(f'{"******":15}')
-
-            print("")
+            self.display_title_bar()
+            print("Filter by the start of the app name (enter for all):")
+            app = input(">> ").strip()
+
+            index = self.name_index()
+            after = None
+            shown = 0
+
+            while True:
+                rows, after = self.db_connect.list_page(self.user_id, after, app=app or None, index=index)
+                self.display_title_bar()
+
+                # printing headers
+                options = ["ID", "App", "Username", "Secrets"]
+                for option in options:
+                    print( f'{option:15}', end="" )
+                print("") 
+
+                # printing passwords
+                for row in rows:
+                    app_id, app_name, username = row
+                    print(f'{str(app_id):15}', end="")
+                    print(f'{str(app_name):15}{str(username) if username != None else "------":15}', end="")
+                    print(f'{"******":15}')
+
+                shown += len(rows)
+                print("")
+
+                if after is None:
+                    break
+
+                print(f'{shown} apps shown. Press enter for the next page or q to stop.')
+                if input("").strip().lower() == "q":
+                    return
+
+            if shown == 0:
+                print("No app was found with that name!")
+            else:
+                print(f'{shown} apps.')
             print("Press enter to continue.")
             input("")
 
-        except NoResultFound:
-            print("")
-            print("No app was found with that name!")
+        except SecretsLocked as error:
+            print(error)
             input("")
         except TypeError as error:
             print(error)
@@ -217,43 +293,59 @@ class VaultApp:
                 copy to clipboard - user can specify 1,2,3,4 (password, secrets..) 
                 show on the console 
         '''
+        from sqlalchemy.exc import NoResultFound
+        from cryptography.fernet import InvalidToken
+
         try:
             self.display_title_bar()
             # which app
             print("App name:")
-            app = input(">> ")
-
-            # get second key to decrypt secrets
-            print("Secret Password")
-            password = getpass(">> ")
+            app = self.resolve_app(input(">> "))
+            if app is None:
+                return
 
-            # create a key
-            key = Encrypt.get_hash(password, self.user_salt)
+            # get the key to decrypt secrets
+            key = self.get_secret_key(confirm=False)
+            if key is None:
+                return
 
             # Query the database
-            res = self.db_connect.select(cols=['app', 'username', 'secrets'], conds={
+            res = self.db_connect.select(cols=['app', 'username', 'secrets', 'key_version'], conds={
                 'user_id': self.user_id, 
                 'app': app
-            } , many=False)
+            } , many=False, index=self.name_index())
+
+            # which secret, only that one is decrypted
+            total = secret_record.count(res[2]) if res[2] is not None else 0
+            field = None
+            if total is None or total > 1:
+                print("Secret number: (Enter for all)")
+                field = input(">> ")
+                field = int(field) if field != "" else None
+                if field is not None and field < 1:
+                    raise IndexError(field)
 
             # get secrets
-            secrets = bytes(res[-1]) 
-            secrets = Encrypt.decrypt(secrets, key) # decrypt
-            secrets = secrets.decode("utf-8")
-            secrets = secrets.split(",") # split the string
+            if res[2] is None:
+                secrets = []
+            elif field is None:
+                secrets = self.decrypt_secrets(res[2], res[3], key)
+            else:
+                secrets = [self.decrypt_secrets(res[2], res[3], key, field - 1)]
 
 
             self.display_title_bar()
 
             # printing headers
             options = ["App", "Username"]
+            first = field or 1
             for val in range(len(secrets) + 2):
                 if val == 0:
                     print( f'{options[0]:15}', end="" )
                 elif val == 1:
                     print( f'{options[1]:15}', end="" )
                 else:
-                    show = f'Secret #{val-1}'
+                    show = f'Secret #{val-2+first}'
                     print(f'{show:15}', end="")
             
             print("\n", end="")
@@ -280,6 +372,11 @@ class VaultApp:
             print("No app was found with that name!")
             input("")
 
+        except (ValueError, IndexError):
+            print("")
+            print("There is no secret with that number!")
+            input("")
+
         except TypeError as error:
             print(error)
             input("")
@@ -314,37 +411,355 @@ class VaultApp:
             s = getpass(">> ")
             secrets.append(s)
 
-        ##
-        # check secret password will be changed 
-        # - meaning, confirm secret password before 
-        #   changing it
-        ##
-        print("2nd Password for ecryption:")
-        s = getpass(">> ")
-        print("Password confirmation:")
-        s1 = getpass(">> ")
-
-        if s1 != s:
-            print("Passwords don't match")
+        key = self.get_secret_key()
+        if key is None:
+            return
+
+        # Encrypt each secret into a record
+        return secret_record.seal(secrets, key)
+
+    def get_secret_key(self, confirm=True):
+        '''
+            Returns the data key for the secrets
+            The key is already cached when the secrets are unlocked
+            Returns None if the passwords don't match or are wrong
+        '''
+        from cryptography.fernet import InvalidToken
+
+        key = Encrypt.get_cached_key(self.user_id, self.user_salt)
+
+        if key is None:
+            # the first unlock sets the 2nd password, a typo would lock the secrets
+            confirm = confirm or self.db_connect.get_wrapped_key(self.user_id) is None
+
+            print("2nd Password for ecryption:")
+            s = getpass(">> ")
+
+            ##
+            # check secret password will be changed 
+            # - meaning, confirm secret password before 
+            #   changing it
+            ##
+            if confirm:
+                print("Password confirmation:")
+                s1 = getpass(">> ")
+
+                if s1 != s:
+                    print("Passwords don't match")
+                    input("")
+                    return
+
+            try:
+                key = unlock_secrets(self.db_connect, self.user_id, self.user_salt, s)
+            except InvalidToken:
+                print("")
+                print("Invalid password!!")
+                input("")
+                return
+
+        return key
+
+    def name_index(self):
+        '''
+            BlindIndex of the app names when they are encrypted
+            None when they are not
+            Raises SecretsLocked if the secrets can't be unlocked
+        '''
+        if not self.names_encrypted:
+            return None
+
+        key = self.get_secret_key(confirm=False)
+        if key is None:
+            raise SecretsLocked
+
+        return BlindIndex(key)
+
+    def decrypt_secrets(self, token, key_version, key, field=None):
+        '''
+            Decrypts the secrets of a row
+            field -> only that secret (from 0)
+            Rows from before the data key that were not moved 
+            use another secret password, it is asked here
+        '''
+        if key_version != DATA_KEY:
+            print("Secret Password (old entry)")
+            password = getpass(">> ")
+            key = Encrypt.get_hash(password, self.user_salt)
+
+        return secret_record.open_secrets(token, key, field)
+
+    def change_secret_password(self):
+        '''
+            Changes the 2nd password
+            Only the wrapped data key is rewritten
+        '''
+        from cryptography.fernet import InvalidToken
+
+        try:
+            self.display_title_bar()
+            print("Current 2nd Password:")
+            old = getpass(">> ")
+            print("New 2nd Password:")
+            new = getpass(">> ")
+            print("Password confirmation:")
+            new2 = getpass(">> ")
+
+            if new != new2:
+                print("Passwords don't match")
+                input("")
+                return
+
+            change_secret_password(self.db_connect, self.user_id, self.user_salt, old, new)
+
+            self.display_title_bar()
+            print("2nd Password changed.")
+            print("Press enter to continue.")
+            input("")
+        except InvalidToken:
+            print("")
+            print("Invalid password!!")
+            input("")
+
+    def import_apps(self):
+        '''
+            Imports the apps from a CSV or JSON file
+        '''
+        try:
+            self.display_title_bar()
+            print("File to import: (.csv, .json, .jsonl)")
+            filename = input(">> ")
+
+            key = self.get_secret_key()
+            if key is None:
+                return
+
+            importer = Importer(self.db_connect, self.user_id, key, index=self.name_index())
+            rows, seconds = importer.run(filename, progress=print_progress)
+            self.finder = None # read again on the next search
+
+            print("")
+            print(f'{rows} apps imported in {seconds:.2f}s.')
+            print("Press enter to continue.")
+            input("")
+        except Exception as error:
+            print("")
+            print(error)
+            input("")
+
+    def export_vault(self):
+        '''
+            Saves all the apps to an encrypted archive
+        '''
+        try:
+            self.display_title_bar()
+            print("Archive file:")
+            filename = input(">> ")
+
+            key = self.get_secret_key()
+            if key is None:
+                return
+
+            rows = export_vault(self.db_connect, self.user_id, filename, key, index=self.name_index())
+
+            print("")
+            print(f'{rows} apps exported.')
+            print("Press enter to continue.")
+            input("")
+        except Exception as error:
+            print("")
+            print(error)
+            input("")
+
+    def restore_vault(self):
+        '''
+            Adds the apps of an archive to the vault
+        '''
+        from cryptography.fernet import InvalidToken
+
+        try:
+            self.display_title_bar()
+            print("Archive file:")
+            filename = input(">> ")
+
+            key = self.get_secret_key()
+            if key is None:
+                return
+
+            rows = restore_vault(self.db_connect, self.user_id, filename, key, index=self.name_index())
+            self.finder = None # read again on the next search
+
+            print("")
+            print(f'{rows} apps restored.')
+            print("Press enter to continue.")
+            input("")
+        except InvalidToken:
+            print("")
+            print("Invalid password or damaged archive!!")
+            input("")
+        except Exception as error:
+            print("")
+            print(error)
+            input("")
+
+    def lock_secrets(self):
+        '''
+            Forgets the secret password of the session
+        '''
+        Encrypt.lock(self.user_id)
+
+        # the finder has the decrypted app names
+        if self.names_encrypted:
+            self.finder = None
+
+        self.display_title_bar()
+        print("Secrets locked.")
+        print("Press enter to continue.")
+        input("")
+
+    def search_apps(self):
+        '''
+            Lists the apps that have some text in their name
+        '''
+        try:
+            self.display_title_bar()
+            print("Search: (start with ^ to match the beginning)")
+            term = input(">> ")
+
+            prefix = term.startswith("^")
+            term = term[1:] if prefix else term
+            if term == "":
+                return
+
+            res = self.db_connect.search(self.user_id, term, prefix, index=self.name_index())
+
+            self.display_title_bar()
+            for option in ["ID", "App", "Username"]:
+                print( f'{option:15}', end="" )
+            print("")
+
+            for app_id, app, username in res:
+                print(f'{str(app_id):15}{app:15}{username:15}')
+
+            print("")
+            print(f'{len(res)} apps found.')
+            print("Press enter to continue.")
+            input("")
+        except SecretsLocked as error:
+            print(error)
+            input("")
+
+    def encrypt_names(self):
+        '''
+            Encrypts the app names and usernames of the vault
+            they are searched by their blind index afterwards
+        '''
+        self.display_title_bar()
+
+        if self.names_encrypted:
+            print("The app names are already encrypted.")
             input("")
             return
 
-        # encrypt the secrets
-        secrets = ",".join(secrets)
+        print("App names and usernames will only be shown with the 2nd password.")
+        print("Continue? y/n")
+        if input(">> ").lower() != "y":
+            return
 
-        # Encrypt secrets and add it to content array 
-        key = Encrypt.get_hash(s, self.user_salt)
-        secrets = Encrypt.encrypt(secrets.encode(), key)
-        return secrets
+        key = self.get_secret_key(confirm=False)
+        if key is None:
+            return
+
+        rows = self.db_connect.encrypt_names(self.user_id, BlindIndex(key))
+        self.names_encrypted = True
+
+        print("")
+        print(f'{rows} apps encrypted.')
+        print("Press enter to continue.")
+        input("")
+
+    def get_finder(self):
+        '''
+            AppFinder of the apps of the user, the apps are
+            read once per session and kept up to date after
+        '''
+        from sqlalchemy.exc import NoResultFound
+
+        if self.finder is None:
+            try:
+                rows = self.db_connect.select(
+                    cols=['id', 'app', 'username'], 
+                    conds={'user_id': self.user_id},
+                    index=self.name_index(),
+                )
+            except NoResultFound:
+                rows = []
+
+            self.finder = AppFinder(rows)
+
+        return self.finder
+
+    def resolve_app(self, app):
+        '''
+            Returns the app name to use for a typed name
+            When no app has that name the closest ones are
+            offered, None if the user cancels
+        '''
+        finder = self.get_finder()
+        if finder.exact(app, ignore_case=self.names_encrypted):
+            return app
+
+        found = finder.find(app, limit=5)
+        if not found:
+            return app
+
+        print("")
+        print("No app was found with that name, did you mean:")
+        for idx, (_, app_id, name, username) in enumerate(found):
+            print(f'{idx+1} - {name} ({username})' if username else f'{idx+1} - {name}')
+        print("Enter to cancel")
+
+        choice = input(">> ")
+        if not choice.isdigit() or not 1 <= int(choice) <= len(found):
+            return None
+
+        return found[int(choice) - 1][2]
+
+    def choose_app(self, old_app, index=None):
+        '''
+            Asks which app is the one when more than one
+            is registered with the same name
+            Returns the id or None
+        '''
+        apps = self.db_connect.select(
+            cols=["id", 'app', 'username'],\
+            conds={
+                'user_id': self.user_id, 
+                'app': old_app
+            }, 
+            index=index,
+        )
+
+        for app in apps:
+            self.display_title_bar()
+            print("There seems to be more than one app registered\n with that name.")
+            print("")
+            print("Is this the app?")
+            print(f'App id {app[0]}, name {app[1]} with username -> {app[2]}')
+            ans = input("(y/n) >>  ")
+
+            if ans.lower() == 'y': 
+                return app[0]
+
+        return None
 
     def edit_app(self):
         '''
             Completely overrides the data of the app
             or leave it be
         '''
-        content = {
-            'user_id': None,
-        }
+        from sqlalchemy.exc import NoResultFound, MultipleResultsFound
+
+        content = {}
 
         try:
             # Get all the data
@@ -353,16 +768,9 @@ class VaultApp:
             print("Enter a new value or press Enter to keep the same.")
 
             print("Old App Name: (for selection)")
-            old_app = input(">> ")
-
-            app_id = self.db_connect.select(
-                cols=["id"],\
-                conds={
-                    'user_id': self.user_id, 
-                    'app': old_app
-                }, 
-                many=False
-            )
+            old_app = self.resolve_app(input(">> "))
+            if old_app is None:
+                return
 
             print('App: ')
             app = input(">> ")
@@ -374,14 +782,18 @@ class VaultApp:
             secrets = self.get_secrets()
 
             # check for changes
-            if app_id != None:
-                content['id'] = app_id[0]
             if app != "":
                 content['app'] = app
             if username != "":
                 content['username'] = username
             if secrets != None:
                 content['secrets'] = secrets
+                content['key_version'] = DATA_KEY
+
+            if not content:
+                print("Nothing to change.")
+                input("")
+                return
             
             print("Is all the info correct? y/n")
             ans = input(">> ")
@@ -390,10 +802,28 @@ class VaultApp:
                 input("")
                 return
 
-            # update values to be saved to the database
-            content['user_id'] = self.user_id
+            index = self.name_index()
+
+            try:
+                # save to DB in one statement
+                res = self.db_connect.update_by_app(self.user_id, old_app, content, index=index)
+                app_id = res[0]
+            except MultipleResultsFound:
+                app_id = self.choose_app(old_app, index)
+
+                if app_id is None:
+                    print("Operation cancelled.")
+                    print("Press enter to continue.")
+                    input("")
+                    return
 
-            res = self.db_connect.update(content) # save to DB
+                # update values to be saved to the database
+                content['id'] = app_id
+                content['user_id'] = self.user_id
+                res = self.db_connect.update(content, index=index)
+
+            if res and self.finder is not None:
+                self.finder.update(app_id, content.get('app'), content.get('username'))
 
             self.display_title_bar()
             if res:
@@ -414,54 +844,36 @@ class VaultApp:
             input("")
     
     def delete_app(self):
-        content = {
-            'user_id': None,
-            'app_id' : None
-        }
+        from sqlalchemy.exc import NoResultFound, MultipleResultsFound
 
         try:
             # Get all the data
             self.display_title_bar()
 
             print("App Name: (for selection)")
-            old_app = input(">> ")
-
-            app_id = self.db_connect.select(
-                cols=["id", 'app', 'username'],\
-                conds={
-                    'user_id': self.user_id, 
-                    'app': old_app
-                }, 
-            )
-
-            # Check how many
-            if len(app_id) > 1:
-                for app in app_id:
-                    self.display_title_bar()
-                    print("There seems to be more than one app registered\n with that name.")
-                    print("")
-                    print("Is this the app?")
-                    print(f'App id {app[0]}, name {app[1]} with username -> {app[2]}')
-                    ans = input("(y/n) >>  ")
-
-                    if ans.lower() == 'y': 
-                        content['id'] = app[0]
-                        break
-            else:
-                content['id'] = app_id[0][0]
-                        
+            old_app = self.resolve_app(input(">> "))
+            if old_app is None:
+                return
 
-            # check for changes
-            if not content['id']:
-                print("Operation cancelled.")
-                print("Press enter to continue.")
-                input("")
-                return 
+            index = self.name_index()
 
-            # user id  
-            content['user_id'] = self.user_id
+            try:
+                # delete in one statement when the name is unique
+                res = self.db_connect.delete_by_app(self.user_id, old_app, index=index)
+                app_id = res[0]
+            except MultipleResultsFound:
+                app_id = self.choose_app(old_app, index)
 
-            res = self.db_connect.delete(content) # save to DB
+                if app_id is None:
+                    print("Operation cancelled.")
+                    print("Press enter to continue.")
+                    input("")
+                    return 
+
+                res = self.db_connect.delete({'user_id': self.user_id, 'id': app_id}, index=index)
+
+            if res and self.finder is not None:
+                self.finder.remove(app_id)
 
             self.display_title_bar()
             if res:
@@ -473,6 +885,10 @@ class VaultApp:
             print("Something went wrong.")
             print("Press enter to continue.")
             input("")
+        except NoResultFound:
+            print("")
+            print("No app was found with that name!")
+            input("")
         except Exception as error:
             print(error)
             input("")
@@ -481,7 +897,9 @@ class VaultApp:
         print("What would like to do?")
 
         options = ["Add App", "Show Apps", "Show Secret", \
-            "Edit App", "Delete App", "Exit"]
+            "Edit App", "Delete App", "Import Apps", "Export Vault", \
+            "Restore Vault", "Change 2nd Password", "Lock Secrets", \
+            "Search Apps", "Encrypt App Names", "Exit"]
 
         for idx, option in enumerate(options):
             print(f'{idx+1} - {option}')
@@ -506,6 +924,20 @@ class VaultApp:
             elif choice == '5':
                 self.delete_app()
             elif choice == '6':
+                self.import_apps()
+            elif choice == '7':
+                self.export_vault()
+            elif choice == '8':
+                self.restore_vault()
+            elif choice == '9':
+                self.change_secret_password()
+            elif choice == '10':
+                self.lock_secrets()
+            elif choice == '11':
+                self.search_apps()
+            elif choice == '12':
+                self.encrypt_names()
+            elif choice == '13':
                 break
             
     def main(self):
@@ -517,12 +949,14 @@ class VaultApp:
         self.authenticate()
 
         if not self.auth:
-            os.system("cls")
+            clear_screen()
             return
         else:
             self.run()
-            os.system("cls")
+            Encrypt.lock(self.user_id)
+            clear_screen()
 
 
 if __name__ == "__main__":
+    instrument.from_env({"app": VaultApp})
     VaultApp().main()
\ No newline at end of file
@@ -0,0 +1,115 @@
+'''
+    Fuzzy search of the apps of a user in memory
+
+    The (id, app, username) rows are read once and indexed by
+    their trigrams, so a query only looks at the apps that share
+    a trigram with it, and typos still find the app:
+
+        finder = AppFinder(rows)
+        finder.find("githbu") -> [(score, id, app, username), ...]
+
+    The index is kept up to date with add, update and remove
+    when the apps change, instead of reading them again.
+'''
+from collections import defaultdict, Counter
+
+GRAM = 3
+
+
+def trigrams(text):
+    '''
+        Trigrams of a text in lower case, padded like pg_trgm
+        so short texts and the start of the name have trigrams too
+    '''
+    text = f'  {text.lower()} '
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class AppFinder:
+    '''
+        Trigram index over the apps of a user
+        rows -> iterable of (id, app, username)
+    '''
+    def __init__(self, rows=()):
+        self.apps = {}
+        self.grams = defaultdict(set)
+
+        for app_id, app, username in rows:
+            self.add(app_id, app, username)
+
+    def __len__(self):
+        return len(self.apps)
+
+    def add(self, app_id, app, username):
+        self.remove(app_id)
+        self.apps[app_id] = (app, username, trigrams(app))
+
+        for gram in self.apps[app_id][2]:
+            self.grams[gram].add(app_id)
+
+    def update(self, app_id, app=None, username=None):
+        '''
+            Changes the app or the username of an app
+            None keeps the value it had
+        '''
+        if app_id not in self.apps:
+            return
+
+        old_app, old_username, _ = self.apps[app_id]
+        self.add(app_id, app if app is not None else old_app,
+            username if username is not None else old_username)
+
+    def remove(self, app_id):
+        entry = self.apps.pop(app_id, None)
+        if entry is None:
+            return
+
+        for gram in entry[2]:
+            ids = self.grams[gram]
+            ids.discard(app_id)
+            if not ids:
+                del self.grams[gram]
+
+    def exact(self, app, ignore_case=False):
+        '''
+            Ids of the apps with that exact name
+        '''
+        if ignore_case:
+            app = app.lower()
+            return [app_id for app_id, entry in self.apps.items() if entry[0].lower() == app]
+
+        return [app_id for app_id, entry in self.apps.items() if entry[0] == app]
+
+    def find(self, query, limit=10, min_score=0.2):
+        '''
+            Apps ranked by how close their name is to the query
+            score -> shared trigrams / all the trigrams of both
+                (1.0 for the same name), names that start with
+                the query get a bonus
+            Returns a list of (score, id, app, username)
+        '''
+        query_grams = trigrams(query)
+        if not query_grams or not query.strip():
+            return []
+
+        # shared trigrams of each app with the query
+        shared = Counter()
+        for gram in query_grams:
+            for app_id in self.grams.get(gram, ()):
+                shared[app_id] += 1
+
+        query = query.lower()
+        found = []
+
+        for app_id, count in shared.items():
+            app, username, app_grams = self.apps[app_id]
+            score = count / (len(query_grams) + len(app_grams) - count)
+
+            if app.lower().startswith(query):
+                score = min(1.0, score + 0.5)
+
+            if score >= min_score:
+                found.append((round(score, 3), app_id, app, username))
+
+        found.sort(key=lambda item: (-item[0], item[2].lower(), item[1]))
+        return found[:limit]
@@ -0,0 +1,329 @@
+'''
+    Asyncio version of DBConnect and Encrypt
+
+    AsyncDBConnect runs on the async engine of SQLAlchemy
+    (asyncpg for postgresql, aiosqlite for sqlite) and has the
+    same methods as DBConnect, as coroutines.
+    The scrypt and Fernet work of AsyncEncrypt runs on executors
+    so the event loop is never blocked.
+
+        db = await AsyncDBConnect.create(url='sqlite+aiosqlite://')
+        res = await db.login(username, password)
+'''
+import asyncio
+from functools import partial
+
+from sqlalchemy import MetaData, select, insert, update, delete, and_
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InvalidRequestError, NoResultFound
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from db_handler import DBConnect, define_tables, pool_options, \
+    set_sqlite_pragmas, upsert_insert
+from encrypt import Encrypt
+from kdf import DEFAULT as DEFAULT_KDF
+from migrations import migrate_connection
+
+# backend -> async driver
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+async def run_blocking(func, *args):
+    '''
+        Runs a blocking function on the default executor
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args))
+
+
+def async_url(db_url):
+    '''
+        Changes the driver of a url to the async one
+    '''
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise Exception(f'No async driver for {backend}.')
+
+    return str(url.set(drivername=ASYNC_DRIVERS[backend]))
+
+
+def make_async_engine(db_url, settings=None, pool=None):
+    '''
+        Same options as make_engine on the async engine
+    '''
+    settings = settings or {}
+    url = make_url(db_url)
+
+    if url.get_backend_name() != 'sqlite':
+        return create_async_engine(url, **pool_options(pool))
+
+    in_memory = url.database in (None, '', ':memory:')
+
+    if in_memory:
+        engine = create_async_engine(url, poolclass=StaticPool)
+    else:
+        engine = create_async_engine(url)
+
+    set_sqlite_pragmas(engine.sync_engine, settings, in_memory)
+    return engine
+
+
+class AsyncEncrypt:
+    '''
+        Encrypt functions that don't block the event loop
+        The KDF runs on the KDF pool of Encrypt
+    '''
+    @staticmethod
+    async def get_hash(password, salt, kdf=None):
+        return await run_blocking(Encrypt.kdf_pool.run, Encrypt.get_hash, password, salt, kdf)
+
+    @staticmethod
+    async def gen_pass_key(password, kdf=None):
+        return await run_blocking(Encrypt.kdf_pool.run, Encrypt.gen_pass_key, password, kdf)
+
+    @staticmethod
+    async def verify_password(password, salt, hashed, kdf=None):
+        return await run_blocking(Encrypt.verify_password, password, salt, hashed, kdf)
+
+    @staticmethod
+    async def encrypt(data, key):
+        return await run_blocking(Encrypt.encrypt, data, key)
+
+    @staticmethod
+    async def decrypt(token, key):
+        return await run_blocking(Encrypt.decrypt, token, key)
+
+    @staticmethod
+    async def encrypt_many(items, key):
+        return await run_blocking(Encrypt.cipher(key).encrypt_many, items)
+
+    @staticmethod
+    async def decrypt_many(tokens, key):
+        return await run_blocking(Encrypt.cipher(key).decrypt_many, tokens)
+
+
+class AsyncDBConnect:
+    '''
+        Async DBConnect, the engine is shared by the process
+        Use AsyncDBConnect.create so the schema is migrated
+    '''
+    engine = None
+    engine_url = None
+
+    # the configuration and the queries are the same as DBConnect
+    read_section = DBConnect.read_section
+    config = DBConnect.config
+    select_query = DBConnect.select_query
+    app_conds = DBConnect.app_conds
+
+    def __init__(self, config_file='./files/db.ini', url=None):
+        '''
+            url -> database url, skips the configuration file
+                the driver is changed to the async one
+        '''
+        self.config_file = config_file
+        self.settings = {}
+        self.pool = {}
+        db_url = async_url(url or self.config())
+
+        if AsyncDBConnect.engine is None or AsyncDBConnect.engine_url != db_url:
+            AsyncDBConnect.engine = make_async_engine(db_url, self.settings, self.pool)
+            AsyncDBConnect.engine_url = db_url
+
+        self.META_DATA = MetaData()
+        define_tables(self.META_DATA)
+        self.account = self.META_DATA.tables['account']
+        self.vault = self.META_DATA.tables['vault']
+
+    @classmethod
+    async def create(cls, config_file='./files/db.ini', url=None):
+        db = cls(config_file, url)
+        await db.get_tables()
+        return db
+
+    async def get_tables(self):
+        '''
+            Creates or updates the schema when it is behind
+        '''
+        async with AsyncDBConnect.engine.begin() as conn:
+            await conn.run_sync(migrate_connection, self.META_DATA)
+
+    @staticmethod
+    async def dispose():
+        '''
+            Closes the connections of the shared engine
+        '''
+        if AsyncDBConnect.engine is not None:
+            await AsyncDBConnect.engine.dispose()
+            AsyncDBConnect.engine = None
+            AsyncDBConnect.engine_url = None
+
+    async def select(self, cols, conds, many=True, ignore_case=False):
+        '''
+            Same as DBConnect.select
+        '''
+        query = self.select_query(cols, conds, ignore_case)
+
+        async with AsyncDBConnect.engine.connect() as conn:
+            res = await conn.execute(query)
+
+            if many:
+                res = res.fetchall()
+            else:
+                res = res.fetchone()
+
+        if not res:
+            raise NoResultFound
+
+        return res
+
+    async def insert(self, content):
+        '''
+            Same as DBConnect.insert
+        '''
+        if content.get("user_id", None) == None:
+            return False
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            await conn.execute(insert(self.vault).values(content))
+
+        return True
+
+    async def insert_many(self, rows):
+        '''
+            Same as DBConnect.insert_many
+        '''
+        if not rows:
+            return 0
+
+        if any(row.get("user_id", None) == None for row in rows):
+            raise InvalidRequestError("Invalid Request: User ID must be specified")
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            await conn.execute(insert(self.vault).values(rows))
+
+        return len(rows)
+
+    async def update(self, content):
+        '''
+            Same as DBConnect.update
+        '''
+        if content.get("user_id", None) == None:
+            return False
+
+        user_id = content.pop('user_id', None)
+        app_id = content.pop("id", None)
+
+        if app_id == None:
+            raise InvalidRequestError("Invalid Request: App ID must be specified")
+
+        query = update(self.vault).values(content).\
+            where(and_(self.vault.c.user_id == user_id, self.vault.c.id == app_id))
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            await conn.execute(query)
+
+        return True
+
+    async def delete(self, content):
+        '''
+            Same as DBConnect.delete
+        '''
+        if content.get("user_id", None) == None:
+            return False
+
+        user_id = content.pop('user_id', None)
+        app_id = content.pop("id", None)
+
+        if app_id == None:
+            raise InvalidRequestError("Invalid Request: App ID must be specified")
+
+        query = delete(self.vault).\
+            where(and_(self.vault.c.user_id == user_id, self.vault.c.id == app_id))
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            await conn.execute(query)
+
+        return True
+
+    async def login(self, username, password):
+        '''
+            Same as DBConnect.login
+            The password is checked after the connection is released
+        '''
+        query = select(self.account.c.id, \
+                    self.account.c.login_salt, \
+                    self.account.c.access_salt, \
+                    self.account.c.hashed_pass, \
+                    self.account.c.kdf, \
+                )\
+                .where(self.account.c.username == username)
+
+        async with AsyncDBConnect.engine.connect() as conn:
+            res = (await conn.execute(query)).fetchone()
+
+        # does not exist
+        if (not res):
+            return None
+
+        user_id, l_salt, a_salt, h_pass, kdf = res
+
+        if not await AsyncEncrypt.verify_password(password, bytes(l_salt), bytes(h_pass), kdf):
+            return None
+
+        if (kdf or DEFAULT_KDF) != Encrypt.login_kdf:
+            await self.rehash(user_id, password, bytes(h_pass))
+
+        return user_id, bytes(a_salt)
+
+    async def rehash(self, user_id, password, old_hash):
+        '''
+            Same as DBConnect.rehash
+        '''
+        kdf = Encrypt.login_kdf
+        h_pass, l_salt = await AsyncEncrypt.gen_pass_key(password, kdf)
+
+        query = update(self.account)\
+            .values(hashed_pass=h_pass, login_salt=l_salt, kdf=kdf)\
+            .where(and_(self.account.c.id == user_id, self.account.c.hashed_pass == old_hash))
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            return (await conn.execute(query)).rowcount == 1
+
+    async def register(self, username, password):
+        '''
+            Same as DBConnect.register
+        '''
+        kdf = Encrypt.login_kdf
+        h_pass, l_salt = await AsyncEncrypt.gen_pass_key(password, kdf)
+        a_salt = Encrypt.get_random_salt()
+
+        values = {
+            'username':username,
+            'hashed_pass': h_pass,
+            'login_salt': l_salt,
+            'access_salt': a_salt,
+            'kdf': kdf,
+        }
+
+        query = upsert_insert(AsyncDBConnect.engine.dialect.name)(self.account).values(values)\
+            .on_conflict_do_nothing(index_elements=[self.account.c.username])
+
+        async with AsyncDBConnect.engine.begin() as conn:
+            if getattr(conn.dialect, "full_returning", False):
+                user_id = (await conn.execute(query.returning(self.account.c.id))).scalar()
+            else:
+                res = await conn.execute(query)
+                # nothing inserted -> the username is already in use
+                user_id = res.inserted_primary_key[0] if res.rowcount == 1 else None
+
+        if user_id is None:
+            return None
+
+        return user_id, a_salt
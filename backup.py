@@ -0,0 +1,87 @@
+'''
+    Export and restore of a user's vault
+
+    The archive is a gzip of JSON lines (one per app) written
+    through EncryptedWriter, so it is compressed and encrypted
+    while the rows are streamed from the database.
+
+    The secrets are kept as they are in the database (already 
+    encrypted with the data key), so an archive is restored on 
+    the same account.
+'''
+import gzip
+import json
+from base64 import b64encode, b64decode
+from itertools import islice
+
+from encrypt import EncryptedWriter, EncryptedReader, atomic_writer
+
+
+def export_vault(db_connect, user_id, filename, key, batch_size=1000, index=None):
+    '''
+        Writes all the apps of the user to filename
+        index -> BlindIndex when the app names are encrypted,
+            the archive has them decrypted (it is encrypted)
+        Returns the number of apps exported
+    '''
+    total = 0
+
+    with atomic_writer(filename) as out:
+        with EncryptedWriter(out, key) as writer, \
+            gzip.GzipFile(fileobj=writer, mode='wb') as archive:
+
+            for rows in db_connect.stream(
+                    cols=['app', 'username', 'secrets', 'key_version'], 
+                    conds={'user_id': user_id}, 
+                    batch_size=batch_size,
+                    index=index):
+
+                for app, username, secrets, key_version in rows:
+                    record = {
+                        'app': app,
+                        'username': username,
+                        'secrets': b64encode(bytes(secrets)).decode() if secrets else None,
+                        'key_version': key_version,
+                    }
+                    archive.write(json.dumps(record).encode() + b"\n")
+
+                total += len(rows)
+
+    return total
+
+
+def read_archive(filename, key):
+    '''
+        Yields the records of an archive
+    '''
+    with open(filename, 'rb') as file:
+        reader = EncryptedReader(file, key)
+
+        with gzip.GzipFile(fileobj=reader, mode='rb') as archive:
+            for line in archive:
+                record = json.loads(line)
+                if record['secrets'] is not None:
+                    record['secrets'] = b64decode(record['secrets'])
+                yield record
+
+
+def restore_vault(db_connect, user_id, filename, key, batch_size=500, index=None):
+    '''
+        Inserts the apps of an archive for the user
+        index -> BlindIndex when the app names are encrypted
+        Returns the number of apps restored
+    '''
+    total = 0
+    records = read_archive(filename, key)
+
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+
+        for record in batch:
+            record['user_id'] = user_id
+
+        total += db_connect.insert_many(batch, index=index)
+
+    return total
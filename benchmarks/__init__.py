@@ -0,0 +1,5 @@
+'''
+    Benchmarks for the vault
+    Run them from the root of the project:
+        python -m benchmarks.<name>
+'''
@@ -0,0 +1,82 @@
+'''
+    Concurrent requests with DBConnect (threads) 
+    against AsyncDBConnect (asyncio) on a SQLite file
+
+        python -m benchmarks.bench_async [requests] [concurrency]
+
+    Each request is a select of an app, every 10th is a login
+'''
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from db_handler import DBConnect
+from async_db_handler import AsyncDBConnect
+
+APPS = 1000
+
+
+def seed(db):
+    user_id, _ = db.register('bench', 'bench')
+    db.insert_many([
+        {'app': f'app{i}', 'username': 'user', 'secrets': b'x' * 120, 'user_id': user_id}
+        for i in range(APPS)
+    ])
+    return user_id
+
+
+def sync_request(db, user_id, i):
+    if i % 10 == 0:
+        return db.login('bench', 'bench')
+    return db.select(cols=['secrets'], conds={'user_id': user_id, 'app': f'app{i % APPS}'}, many=False)
+
+
+async def async_request(db, user_id, i):
+    if i % 10 == 0:
+        return await db.login('bench', 'bench')
+    return await db.select(cols=['secrets'], conds={'user_id': user_id, 'app': f'app{i % APPS}'}, many=False)
+
+
+def run_sync(db, user_id, requests, concurrency):
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda i: sync_request(db, user_id, i), range(requests)))
+    return perf_counter() - start
+
+
+async def run_async(url, user_id, requests, concurrency):
+    db = await AsyncDBConnect.create(url=url)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(i):
+        async with slots:
+            return await async_request(db, user_id, i)
+
+    start = perf_counter()
+    await asyncio.gather(*[limited(i) for i in range(requests)])
+    seconds = perf_counter() - start
+
+    await AsyncDBConnect.dispose()
+    return seconds
+
+
+def main(requests=2000, concurrency=32):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f'sqlite:///{os.path.join(directory, "bench.db")}'
+        db = DBConnect(url=url)
+        user_id = seed(db)
+
+        seconds = run_sync(db, user_id, requests, concurrency)
+        print(f'{"sync":10}{requests / seconds:12.0f} req/sec')
+
+        seconds = asyncio.run(run_async(url, user_id, requests, concurrency))
+        print(f'{"async":10}{requests / seconds:12.0f} req/sec')
+
+        DBConnect.dispose()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
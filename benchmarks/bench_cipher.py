@@ -0,0 +1,50 @@
+'''
+    Per token cost of building Fernet on every call
+    against reusing a Cipher from Encrypt.cipher
+
+        python -m benchmarks.bench_cipher [tokens]
+'''
+import sys
+from time import perf_counter
+
+from cryptography.fernet import Fernet
+from encrypt import Encrypt
+
+
+def per_token(func, count):
+    start = perf_counter()
+    func(count)
+    return (perf_counter() - start) / count * 1e6 # microseconds
+
+
+def main(count=20000):
+    key = Encrypt.gen_random_key()
+    data = b"user,password,secret answer,another one"
+    tokens = Encrypt.cipher(key).encrypt_many([data] * count)
+
+    def fernet_encrypt(n):
+        for _ in range(n):
+            Fernet(key).encrypt(data)
+
+    def fernet_decrypt(n):
+        for token in tokens[:n]:
+            Fernet(key).decrypt(token)
+
+    def cipher_encrypt(n):
+        Encrypt.cipher(key).encrypt_many([data] * n)
+
+    def cipher_decrypt(n):
+        Encrypt.cipher(key).decrypt_many(tokens[:n])
+
+    print(f'{"operation":20}{"before us/token":>18}{"after us/token":>18}')
+    for name, before, after in (
+        ("encrypt", fernet_encrypt, cipher_encrypt),
+        ("decrypt", fernet_decrypt, cipher_decrypt),
+    ):
+        b = per_token(before, count)
+        a = per_token(after, count)
+        print(f'{name:20}{b:18.2f}{a:18.2f}')
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,55 @@
+'''
+    Throughput of the CRUD paths of DBConnect on SQLite
+
+        python -m benchmarks.bench_crud [rows] [database file]
+
+    Without a file the database is kept in memory
+'''
+import os
+import sys
+from time import perf_counter
+
+from db_handler import DBConnect
+
+
+def timed(name, count, func):
+    start = perf_counter()
+    func()
+    seconds = perf_counter() - start
+    print(f'{name:15}{count / seconds:15.0f} ops/sec')
+
+
+def main(rows=2000, path=None):
+    url = f'sqlite:///{path}' if path else 'sqlite://'
+    db = DBConnect(url=url)
+
+    with DBConnect.engine.begin() as conn:
+        user_id = conn.execute(db.account.insert().values(
+            username=f'bench-{os.getpid()}', hashed_pass=b'', access_salt=b'', login_salt=b''
+        )).inserted_primary_key[0]
+
+    content = lambda i: {'app': f'app{i}', 'username': 'user', 'secrets': b'x' * 120, 'user_id': user_id}
+
+    timed("insert", rows, lambda: [db.insert(content(i)) for i in range(rows)])
+    timed("insert_many", rows, lambda: [
+        db.insert_many([content(i) for i in range(start, min(start + 500, rows))])
+        for start in range(0, rows, 500)
+    ])
+
+    ids = [row[0] for row in db.select(cols=['id'], conds={'user_id': user_id})]
+
+    timed("select", rows, lambda: [
+        db.select(cols=['secrets'], conds={'user_id': user_id, 'app': f'app{i}'}, many=False)
+        for i in range(rows)
+    ])
+    timed("update", rows, lambda: [
+        db.update({'user_id': user_id, 'id': app_id, 'username': 'other'}) for app_id in ids[:rows]
+    ])
+    timed("delete", len(ids), lambda: [
+        db.delete({'user_id': user_id, 'id': app_id}) for app_id in ids
+    ])
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 2000, args[1] if len(args) > 1 else None)
@@ -0,0 +1,126 @@
+'''
+    Cold start time of the entry points
+
+        python -m benchmarks.bench_startup [--runs 5] [--max-ms 300] [module ...]
+
+    Runs each entry point as a user would and times it until
+    it shows its first screen (the menu of the console, the
+    "Serving on" line of the service, the answer of cli.py),
+    then prints its import time and heaviest imports from
+    -X importtime (medians of the runs). With --max-ms it exits
+    with 1 when a first screen takes longer, so CI can track it.
+'''
+import argparse
+import os
+import re
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+# module -> (arguments, text of its first screen or None to
+# wait for the end, environment)
+ENTRY_POINTS = {
+    'app_console': (["app_console.py"], b">> ", {}),
+    'service': (["service.py", "--url", "sqlite://", "--port", "0"], b"Serving on", {}),
+    # an unknown user, cli.py answers after a login query
+    'cli': (["cli.py", "--url", "sqlite://", "ls"], None,
+        {"VAULT_USERNAME": "bench", "VAULT_PASSWORD": "bench"}),
+}
+
+
+def screen_time(module):
+    '''
+        Milliseconds from the start of the entry point until
+        its first screen, in a fresh interpreter
+    '''
+    args, marker, env = ENTRY_POINTS[module]
+    env = dict(os.environ, PYTHONUNBUFFERED="1", **env)
+
+    start = perf_counter()
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    try:
+        if marker is None:
+            proc.communicate()
+            return (perf_counter() - start) * 1000
+
+        output = b""
+        while marker not in output:
+            data = proc.stdout.read1(4096)
+            if not data:
+                raise Exception(f'{module} ended before its first screen: {output.decode()}')
+            output += data
+        return (perf_counter() - start) * 1000
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def import_times(module):
+    '''
+        Returns (total, {import: cumulative}) in microseconds,
+        for the module and its direct imports, from a fresh 
+        interpreter
+    '''
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+
+    children = {}
+    for line in res.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+
+        # the imports of a module are printed before it,
+        # one space is the top level and 3 are its imports
+        depth, name, cumulative = len(match.group(3)), match.group(4), int(match.group(2))
+        if depth == 3:
+            children[name] = cumulative
+        elif depth == 1:
+            if name == module:
+                return cumulative, children
+            children = {}
+
+    raise Exception(f'{module} was not imported')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=["cli", "app_console", "service"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--max-ms", type=float)
+    args = parser.parse_args(argv)
+
+    over_budget = False
+
+    for module in args.modules:
+        screen = median(screen_time(module) for _ in range(args.runs))
+        runs = [import_times(module) for _ in range(args.runs)]
+        total = median(run[0] for run in runs) / 1000
+
+        print(f'{module:15}{screen:10.1f} ms to the first screen, {total:.1f} ms of imports')
+
+        heaviest = sorted(
+            ((median(run[1].get(name, 0) for run in runs) / 1000, name) for name in runs[0][1]),
+            reverse=True,
+        )
+        for ms, name in heaviest[:args.top]:
+            print(f'    {name:30}{ms:10.1f} ms')
+
+        if args.max_ms is not None and screen > args.max_ms:
+            print(f'    over the budget of {args.max_ms} ms')
+            over_budget = True
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
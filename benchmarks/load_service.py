@@ -0,0 +1,104 @@
+'''
+    Load test of the JSON service against an SQLite file
+
+        python -m benchmarks.load_service [requests] [clients]
+
+    Starts the service on a free port, seeds one user with
+    apps, and every client logs in, unlocks and reads/lists
+    apps over a keep-alive connection.
+
+    The database is a file in a temporary directory, so the
+    requests get their own connections from the pool like
+    on a real database (in memory they would take turns on
+    a single connection).
+'''
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from time import perf_counter
+
+from db_handler import DBConnect
+from service import VaultService
+
+APPS = 200
+
+
+class Client:
+    def __init__(self, port):
+        self.conn = HTTPConnection("127.0.0.1", port)
+        self.token = None
+
+    def call(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f'Bearer {self.token}'
+
+        self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        res = self.conn.getresponse()
+        data = json.loads(res.read())
+
+        if res.status >= 400:
+            raise Exception(f'{method} {path} -> {res.status} {data}')
+        return data
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main(requests=2000, clients=8):
+    with tempfile.TemporaryDirectory() as tmp:
+        run(f'sqlite:///{os.path.join(tmp, "load.db")}', requests, clients)
+        DBConnect.dispose()
+
+
+def run(url, requests, clients):
+    db = DBConnect(url=url)
+    server = VaultService(("127.0.0.1", 0), db)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    seed = Client(port)
+    db.register("load", "load")
+    seed.token = seed.call("POST", "/login", {"username": "load", "password": "load"})["token"]
+    seed.call("POST", "/unlock", {"password": "secret"})
+    for i in range(APPS):
+        seed.call("POST", "/apps", {"app": f'app{i}', "username": "user", "secrets": ["a", "b"]})
+
+    def worker(count):
+        client = Client(port)
+        client.token = client.call("POST", "/login", {"username": "load", "password": "load"})["token"]
+        client.call("POST", "/unlock", {"password": "secret"})
+
+        latencies = []
+        for i in range(count):
+            start = perf_counter()
+            if i % 20 == 0:
+                client.call("GET", "/apps")
+            else:
+                client.call("GET", f'/apps/app{i % APPS}')
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    start = perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = pool.map(worker, [requests // clients] * clients)
+        latencies = [value for result in results for value in result]
+    seconds = perf_counter() - start
+
+    print(f'{len(latencies)} requests, {clients} clients, {seconds:.2f}s (with logins)')
+    print(f'throughput {len(latencies) / seconds:.0f} req/sec')
+    for pct in (50, 95, 99):
+        print(f'p{pct} {percentile(latencies, pct) * 1000:.2f} ms')
+
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
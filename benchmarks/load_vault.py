@@ -0,0 +1,318 @@
+'''
+    Load test of DBConnect with many concurrent vault users
+
+        python -m benchmarks.load_vault [--accounts 50] [--entries 100]
+            [--workers 1,8,32] [--ops 4000] [--duration 30]
+            [--mix login=1,list=2,read=10,edit=2] [--processes]
+            [--url postgresql://...] [--kdf scrypt$n=1024,r=8,p=1]
+
+    Seeds the accounts with their entries, then for each number
+    of workers replays the mix of operations on random accounts
+    from threads (or processes with --processes) and reports the
+    throughput, the p50 / p95 / p99 latencies and the errors of
+    each operation:
+
+        login -> DBConnect.login (KDF included)
+        list  -> id, app and username of all the apps of a user
+        read  -> secrets of one app, one field decrypted
+        edit  -> new secrets sealed and saved on one app
+
+    The default database is an SQLite file in a temporary
+    directory, so processes can share it. --url takes any
+    database url of DBConnect, like a local Postgres started
+    without a container (pg_ctl) or a file of your own.
+    --kdf sets Encrypt.login_kdf, a cheaper one measures the
+    database more than the password hashing.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from time import perf_counter
+
+from sqlalchemy.engine import make_url
+
+from db_handler import DBConnect
+from encrypt import Encrypt
+from kdf import parse as parse_kdf
+import secret_record
+from benchmarks.load_service import percentile
+
+OPERATIONS = ('login', 'list', 'read', 'edit')
+MIX = "login=1,list=2,read=10,edit=2"
+
+# error messages kept per operation
+MAX_ERRORS = 5
+
+
+def parse_mix(text):
+    '''
+        "login=1,read=10" -> {"login": 1, "read": 10}
+    '''
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation {name}, use one of {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+
+    if not any(mix.values()):
+        raise ValueError("The mix needs an operation with a weight.")
+    return mix
+
+
+def seed(db, accounts, entries, batch_size=500):
+    '''
+        Registers the accounts and fills their vaults
+        Returns a list of (username, password, user_id, key)
+        key -> data key of the secrets of the account
+    '''
+    users = []
+    for n in range(accounts):
+        username, password = f'load{n}', f'password{n}'
+        registered = db.register(username, password)
+        if registered is None:
+            raise Exception(f'{username} already exists, use an empty database.')
+
+        user_id = registered[0]
+        key = Encrypt.gen_random_key()
+        users.append((username, password, user_id, key))
+
+        for start in range(0, entries, batch_size):
+            db.insert_many([
+                {
+                    'app': f'app{i}',
+                    'username': f'user{i}',
+                    'secrets': secret_record.seal([f'secret{i}', 'pin'], key),
+                    'user_id': user_id,
+                }
+                for i in range(start, min(start + batch_size, entries))
+            ])
+
+    return users
+
+
+class Worker:
+    '''
+        Replays the mix of operations as random users
+    '''
+    def __init__(self, db, users, entries, mix, seed=None):
+        self.db = db
+        self.users = users
+        self.entries = entries
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.rng = random.Random(seed)
+
+    def login(self, user):
+        username, password, user_id, _ = user
+        if self.db.login(username, password) is None:
+            raise Exception(f'{username} could not log in')
+
+    def list(self, user):
+        self.db.select(cols=['id', 'app', 'username'], conds={'user_id': user[2]})
+
+    def read(self, user):
+        _, _, user_id, key = user
+        app = f'app{self.rng.randrange(self.entries)}'
+        res = self.db.select(cols=['secrets'], conds={'user_id': user_id, 'app': app}, many=False)
+        if res is None:
+            raise Exception(f'{app} not found')
+        secret_record.open_secrets(bytes(res[0]), key, 0)
+
+    def edit(self, user):
+        _, _, user_id, key = user
+        i = self.rng.randrange(self.entries)
+        secrets = secret_record.seal([f'secret{i}-{self.rng.random()}', 'pin'], key)
+        self.db.update_by_app(user_id, f'app{i}', {'secrets': secrets})
+
+    def run(self, ops, deadline):
+        '''
+            Runs ops operations or until the deadline (perf_counter)
+            Returns {operation: (latencies, errors, messages)}
+        '''
+        results = {name: ([], 0, []) for name in self.names}
+
+        for _ in range(ops):
+            if deadline and perf_counter() > deadline:
+                break
+
+            name = self.rng.choices(self.names, self.weights)[0]
+            user = self.rng.choice(self.users)
+            latencies, errors, messages = results[name]
+
+            start = perf_counter()
+            try:
+                getattr(self, name)(user)
+            except Exception as e:
+                results[name] = (latencies, errors + 1, messages)
+                if len(messages) < MAX_ERRORS:
+                    messages.append(f'{type(e).__name__}: {e}')
+                continue
+            latencies.append(perf_counter() - start)
+
+        return results
+
+
+def run_worker(url, kdf, users, entries, mix, ops, seconds, seed):
+    '''
+        One worker, in a thread or in its own process
+        (a process makes its own engine from the url)
+        Returns the results of Worker.run and the seconds it ran,
+        without the start of the process
+    '''
+    if kdf:
+        Encrypt.login_kdf = kdf
+
+    worker = Worker(DBConnect(url=url), users, entries, mix, seed)
+    start = perf_counter()
+    results = worker.run(ops, start + seconds if seconds else None)
+    return results, perf_counter() - start
+
+
+def merge(results):
+    '''
+        Joins the results of the workers by operation
+    '''
+    merged = {}
+    for result in results:
+        for name, (latencies, errors, messages) in result.items():
+            total = merged.setdefault(name, ([], [0], []))
+            total[0].extend(latencies)
+            total[1][0] += errors
+            total[2].extend(messages[:MAX_ERRORS - len(total[2])])
+
+    return {name: (latencies, errors[0], messages) for name, (latencies, errors, messages) in merged.items()}
+
+
+def summarize(merged, seconds):
+    '''
+        Throughput, latencies (ms) and error rate by operation
+        and for all of them ("all")
+    '''
+    def stats(latencies, errors):
+        count = len(latencies) + errors
+        return {
+            "ops": count,
+            "ops_per_sec": round(count / seconds, 1) if seconds else 0.0,
+            "errors": errors,
+            "error_rate": round(errors / count, 4) if count else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1e3, 3) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1e3, 3) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1e3, 3) if latencies else None,
+        }
+
+    summary = {name: stats(latencies, errors) for name, (latencies, errors, _) in merged.items()}
+    summary["all"] = stats(
+        [value for latencies, _, _ in merged.values() for value in latencies],
+        sum(errors for _, errors, _ in merged.values()),
+    )
+    return summary
+
+
+def run_level(args, users, mix, workers):
+    '''
+        Runs the load with that many workers
+        Returns the summary and the first error messages
+    '''
+    ops = max(1, args.ops // workers)
+    if args.processes:
+        # spawned, a forked process would share the engine and the KDF pool threads of this one
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        pool = ThreadPoolExecutor(workers)
+
+    with pool:
+        futures = [
+            pool.submit(run_worker, args.url, args.kdf, users, args.entries, mix, ops, args.duration, n)
+            for n in range(workers)
+        ]
+        done = [future.result() for future in futures]
+
+    # the workers run side by side, the slowest one is the length of the run
+    merged = merge(results for results, _ in done)
+    seconds = max(took for _, took in done)
+
+    messages = [message for _, _, errors in merged.values() for message in errors]
+    return summarize(merged, seconds), messages
+
+
+def print_summary(workers, summary, messages):
+    print(f'\n{workers} workers')
+    print(f'{"operation":12}{"ops":>8}{"ops/sec":>10}{"errors":>8}{"err %":>8}'
+        f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+
+    for name, s in summary.items():
+        latencies = "".join(f'{s[key]:10.2f}' if s[key] is not None else f'{"-":>10}'
+            for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f'{name:12}{s["ops"]:8}{s["ops_per_sec"]:10.1f}{s["errors"]:8}'
+            f'{s["error_rate"] * 100:8.2f}{latencies}')
+
+    for message in messages:
+        print(f'  {message}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of DBConnect with concurrent users")
+    parser.add_argument("--url", help="database url, an SQLite file in a temporary directory by default")
+    parser.add_argument("--accounts", type=int, default=50)
+    parser.add_argument("--entries", type=int, default=100, help="apps per account")
+    parser.add_argument("--workers", default="1,8,32", help="numbers of concurrent workers to run, like 1,8,32")
+    parser.add_argument("--ops", type=int, default=4000, help="operations per run, split between the workers")
+    parser.add_argument("--duration", type=float, default=0, help="stops a run after these seconds")
+    parser.add_argument("--mix", default=MIX, help="weights of the operations")
+    parser.add_argument("--processes", action="store_true", help="workers in processes instead of threads")
+    parser.add_argument("--kdf", help="KDF of the logins, like scrypt$n=1024,r=8,p=1")
+    parser.add_argument("--out", help="saves the results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+        levels = [int(workers) for workers in args.workers.split(",") if workers]
+        if args.kdf:
+            parse_kdf(args.kdf)
+            Encrypt.login_kdf = args.kdf
+    except Exception as e:
+        parser.error(str(e))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.url:
+            args.url = f'sqlite:///{os.path.join(tmp, "load.db")}'
+        elif args.processes and args.url in ('sqlite://', 'sqlite:///:memory:'):
+            raise SystemExit("Processes can't share an SQLite database in memory.")
+
+        db = DBConnect(url=args.url)
+        start = perf_counter()
+        users = seed(db, args.accounts, args.entries)
+        print(f'{args.accounts} accounts with {args.entries} apps seeded in {perf_counter() - start:.1f}s',
+            file=sys.stderr)
+
+        results = {}
+        for workers in levels:
+            summary, messages = run_level(args, users, mix, workers)
+            print_summary(workers, summary, messages)
+            results[workers] = summary
+
+        DBConnect.dispose()
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump({
+                "url": make_url(args.url).render_as_string(hide_password=True),
+                "accounts": args.accounts,
+                "entries": args.entries,
+                "mix": mix,
+                "processes": args.processes,
+                "results": results,
+            }, file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+'''
+    Benchmark suite of the hot paths, offline on SQLite in memory
+
+        python -m benchmarks.suite [--sizes 10,1000,100000] [--out results.json]
+        python -m benchmarks.suite --baseline results.json [--tolerance 0.2]
+
+    Covers the KDF (get_hash, gen_pass_key), Fernet and secret
+    records by payload size, and the DBConnect select / insert /
+    update / delete / list / page / login paths on vaults of each size
+    (1000000 rows takes a few minutes to fill).
+
+    Results are JSON: {"meta": {...}, "results": {name: {value, unit, better}}}
+    With --baseline the results are compared with a saved run,
+    and the exit code is 1 when something got slower than the
+    tolerance allows.
+'''
+import argparse
+import json
+import platform
+import random
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+
+import sqlalchemy
+
+from db_handler import DBConnect
+from encrypt import Encrypt
+from kdf import DEFAULT as DEFAULT_KDF
+import secret_record
+
+PAYLOAD_SIZES = (64, 1024, 16 * 1024, 1024 * 1024)
+DB_SIZES = (10, 1000, 100000)
+
+
+def measure(func, number, repeat=3):
+    '''
+        Best seconds per call of func over repeat runs of number calls
+    '''
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        took = (perf_counter() - start) / number
+        best = took if best is None else min(best, took)
+    return best
+
+
+class Suite:
+    def __init__(self, quick=False):
+        self.results = {}
+        self.quick = quick
+
+    def add(self, name, value, unit, better="lower"):
+        self.results[name] = {"value": round(value, 3), "unit": unit, "better": better}
+        print(f'{name:40}{value:14.3f} {unit}', file=sys.stderr)
+
+    def count(self, number):
+        return max(1, number // 10) if self.quick else number
+
+    # Benchmarks
+    def kdf(self):
+        salt = Encrypt.get_random_salt()
+        self.add("kdf.get_hash", measure(lambda: Encrypt.get_hash("password", salt), self.count(10)) * 1e3, "ms")
+        self.add("kdf.gen_pass_key", measure(lambda: Encrypt.gen_pass_key("password"), self.count(10)) * 1e3, "ms")
+
+        if Encrypt.login_kdf != DEFAULT_KDF:
+            self.add("kdf.login_kdf", measure(
+                lambda: Encrypt.get_hash("password", salt, Encrypt.login_kdf), self.count(10)) * 1e3, "ms")
+
+    def fernet(self):
+        key = Encrypt.gen_random_key()
+        cipher = Encrypt.cipher(key)
+
+        for size in PAYLOAD_SIZES:
+            data = random.randbytes(size)
+            token = cipher.encrypt(data)
+            number = self.count(max(5, 2000 * 1024 // max(size, 1024)))
+
+            seconds = measure(lambda: cipher.encrypt(data), number)
+            self.add(f'fernet.encrypt.{size}B', size / seconds / 2**20, "MiB/s", "higher")
+            seconds = measure(lambda: cipher.decrypt(token), number)
+            self.add(f'fernet.decrypt.{size}B', size / seconds / 2**20, "MiB/s", "higher")
+
+        secrets = ["password", "first pet", "mother's maiden name", "1234"]
+        record = secret_record.seal(secrets, key)
+        number = self.count(2000)
+        self.add("record.seal", measure(lambda: secret_record.seal(secrets, key), number) * 1e6, "us")
+        self.add("record.open", measure(lambda: secret_record.open_secrets(record, key), number) * 1e6, "us")
+        self.add("record.open_one", measure(lambda: secret_record.open_secrets(record, key, 1), number) * 1e6, "us")
+
+    def database(self, rows):
+        # a new database in memory for each size
+        DBConnect.dispose()
+        db = DBConnect(url='sqlite://')
+        user_id, _ = db.register("bench", "password")
+        secrets = b"x" * 200
+
+        for start in range(0, rows, 500):
+            db.insert_many([
+                {'app': f'app{i}', 'username': 'user', 'secrets': secrets, 'user_id': user_id}
+                for i in range(start, min(start + 500, rows))
+            ])
+
+        rng = random.Random(rows)
+        ids = [row[0] for row in db.select(cols=['id'], conds={'user_id': user_id})]
+        number = self.count(500)
+        prefix = f'db.{rows}'
+
+        def select_one():
+            db.select(cols=['secrets'], conds={'user_id': user_id, 'app': f'app{rng.randrange(rows)}'}, many=False)
+
+        def update_one():
+            db.update({'user_id': user_id, 'id': rng.choice(ids), 'username': 'other'})
+
+        new_ids = []
+        def insert_one():
+            new_ids.append(db.insert({'app': 'new', 'username': 'user', 'secrets': secrets, 'user_id': user_id}))
+
+        def delete_one():
+            db.delete({'user_id': user_id, 'id': new_ids.pop()})
+
+        self.add(f'{prefix}.select', measure(select_one, number) * 1e6, "us")
+        self.add(f'{prefix}.insert', measure(insert_one, number) * 1e6, "us")
+        self.add(f'{prefix}.update', measure(update_one, number) * 1e6, "us")
+        # one delete per inserted row, so the vault keeps its size
+        self.add(f'{prefix}.delete', measure(delete_one, number) * 1e6, "us")
+
+        if rows <= 100000:
+            list_all = lambda: db.select(cols=['id', 'app', 'username'], conds={'user_id': user_id})
+            self.add(f'{prefix}.list', measure(list_all, self.count(5)) * 1e3, "ms")
+
+        # first page of show_apps, the same at every size
+        first_page = lambda: db.list_page(user_id, size=50)
+        self.add(f'{prefix}.page', measure(first_page, self.count(500)) * 1e6, "us")
+
+        self.add(f'{prefix}.login', measure(lambda: db.login("bench", "password"), self.count(5)) * 1e3, "ms")
+        DBConnect.dispose()
+
+    def run(self, sizes):
+        self.kdf()
+        self.fernet()
+        for rows in sizes:
+            self.database(rows)
+
+        return {
+            "meta": {
+                "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "sqlalchemy": sqlalchemy.__version__,
+                "quick": self.quick,
+            },
+            "results": self.results,
+        }
+
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+        Prints the change of each result against the baseline
+        Returns the names that got worse than tolerance (0.2 -> 20%)
+    '''
+    worse = []
+    print(f'{"benchmark":40}{"baseline":>14}{"now":>14}{"change":>10}')
+
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None or not old["value"]:
+            continue
+
+        change = result["value"] / old["value"] - 1
+        slower = change > tolerance if result["better"] == "lower" else change < -tolerance
+        if slower:
+            worse.append(name)
+
+        flag = "  SLOWER" if slower else ""
+        print(f'{name:40}{old["value"]:14.3f}{result["value"]:14.3f}{change:+10.1%}{flag}')
+
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of Encrypt and DBConnect")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DB_SIZES),
+        help="vault sizes, like 10,1000,100000,1000000")
+    parser.add_argument("--out", help="saves the results to a file")
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    results = Suite(args.quick).run(sizes)
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(results, file, indent=2)
+    elif not args.baseline:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            worse = compare(results, json.load(file), args.tolerance)
+
+        if worse:
+            print(f'{len(worse)} benchmarks are slower than the baseline.')
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+'''
+    Encrypted app names and usernames with blind indexes
+
+    When an account has its names encrypted, app and username are
+    saved as a record (secret_record) on vault.names and the
+    plain columns are left empty. Lookups use keyed hashes (HMAC)
+    of the names instead, so they still go through indexes:
+
+        vault.app_index, vault.username_index -> exact lookups
+        vault_gram -> hashes of the prefixes and trigrams of
+            the app name, for prefix and substring search
+
+    Names are compared in lower case. The hashes only match the
+    same text, but a search can match more apps than it should
+    (trigrams in another order), so the results are checked
+    again after the names are decrypted.
+
+    The HMAC key is derived from the data key of the account,
+    so the secrets must be unlocked to read or search the names.
+'''
+import hmac
+from base64 import urlsafe_b64decode
+from hashlib import sha256
+
+import secret_record
+
+# prefixes of the app name that are indexed, longer
+# prefixes are searched with the first MAX_PREFIX characters
+MAX_PREFIX = 16
+GRAM = 3
+HASH_SIZE = 16
+
+
+def index_key(key):
+    '''
+        Derives the HMAC key of the blind indexes from a data key
+        so the index never uses the key of the names
+    '''
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    from cryptography.hazmat.primitives.hashes import SHA256
+
+    hkdf = HKDF(SHA256(), 32, salt=None, info=b"vault-blind-index")
+    return hkdf.derive(urlsafe_b64decode(key))
+
+
+class BlindIndex:
+    '''
+        Hashes and encrypts the names of an account
+        key -> data key of the account
+    '''
+    def __init__(self, key):
+        self.key = key
+        self._index_key = index_key(key)
+
+    def hash(self, kind, value):
+        '''
+            Keyed hash of a value, kind keeps the hashes of
+            apps, usernames, prefixes and trigrams apart
+        '''
+        data = kind.encode() + b"\0" + value.lower().encode("utf-8")
+        return hmac.new(self._index_key, data, sha256).digest()[:HASH_SIZE]
+
+    def app(self, app):
+        return self.hash("app", app)
+
+    def username(self, username):
+        return self.hash("username", username)
+
+    def grams(self, app):
+        '''
+            Hashes of the prefixes and trigrams of an app name
+        '''
+        app = app.lower()
+        grams = {self.hash("prefix", app[:size]) for size in range(1, min(len(app), MAX_PREFIX) + 1)}
+        grams.update(self.hash("gram", app[i:i + GRAM]) for i in range(len(app) - GRAM + 1))
+        return grams
+
+    def search_grams(self, term, prefix=False):
+        '''
+            Hashes an app must have to match a search
+            Substrings shorter than a trigram are searched as prefixes
+        '''
+        term = term.lower()
+
+        if prefix or len(term) < GRAM:
+            return {self.hash("prefix", term[:MAX_PREFIX])}
+
+        return {self.hash("gram", term[i:i + GRAM]) for i in range(len(term) - GRAM + 1)}
+
+    @staticmethod
+    def matches(app, term, prefix=False):
+        '''
+            Checks a decrypted name against a search
+        '''
+        app, term = app.lower(), term.lower()
+        if prefix or len(term) < GRAM:
+            return app.startswith(term)
+        return term in app
+
+    def seal(self, app, username):
+        return secret_record.seal([app, username], self.key)
+
+    def open(self, names):
+        '''
+            Returns (app, username) of vault.names
+        '''
+        app, username = secret_record.open_secrets(names, self.key)
+        return app, username
+
+    def columns(self, app, username):
+        '''
+            Vault columns of an encrypted app and username
+        '''
+        return {
+            'app': '',
+            'username': '',
+            'names': self.seal(app, username),
+            'app_index': self.app(app),
+            'username_index': self.username(username),
+        }
@@ -0,0 +1,261 @@
+'''
+    Non interactive command line of the vault
+    Authenticates once, runs one command and exits
+
+        python cli.py ls [--search TEXT [--prefix]] [--json]
+        python cli.py get <app> [--username NAME] [--field N] [--json]
+        python cli.py add <app> [--username NAME] [--secret S ...]
+        python cli.py rm <app> [--username NAME]
+        python cli.py import <file>
+
+    Credentials come from the environment:
+        VAULT_USERNAME, VAULT_PASSWORD, VAULT_SECRET_PASSWORD (2nd password)
+    or, when missing, one line each from stdin in that order
+    (prompted when stdin is a terminal).
+    add reads the secrets from the next stdin lines when no --secret is given.
+
+    Exit codes: 0 ok, 1 error, 2 usage, 3 wrong credentials, 4 not found
+'''
+import argparse
+import json
+import os
+import sys
+from getpass import getpass
+
+# SQLAlchemy and cryptography are imported when a command needs
+# them, so --help and usage errors don't pay for them
+
+EXIT_ERROR = 1
+EXIT_AUTH = 3
+EXIT_NOT_FOUND = 4
+
+
+class CLIError(Exception):
+    def __init__(self, message, code=EXIT_ERROR):
+        super().__init__(message)
+        self.code = code
+
+
+def read_value(env, prompt, secret=True):
+    '''
+        Value from the environment, or from stdin
+    '''
+    value = os.environ.get(env)
+    if value is not None:
+        return value
+
+    if sys.stdin.isatty():
+        return getpass(f'{prompt}: ', stream=sys.stderr) if secret else input(f'{prompt}: ')
+
+    line = sys.stdin.readline()
+    if not line:
+        raise CLIError(f'{env} is not set and stdin is empty', EXIT_AUTH)
+    return line.rstrip("\n")
+
+
+class VaultCLI:
+    def __init__(self, args):
+        from db_handler import DBConnect
+
+        self.args = args
+        self.db_connect = DBConnect(args.config, url=args.url)
+        self.user_id = None
+        self.user_salt = None
+        self.key = None
+
+    def login(self):
+        username = read_value("VAULT_USERNAME", "Username", secret=False)
+        password = read_value("VAULT_PASSWORD", "Password")
+
+        res = self.db_connect.login(username, password)
+        if not res:
+            raise CLIError("username and password are wrong.", EXIT_AUTH)
+
+        self.user_id, self.user_salt = res
+
+    def secret_key(self):
+        from cryptography.fernet import InvalidToken
+        from vault_keys import unlock_secrets
+
+        if self.key is not None:
+            return self.key
+
+        password = read_value("VAULT_SECRET_PASSWORD", "2nd Password")
+        try:
+            self.key = unlock_secrets(self.db_connect, self.user_id, self.user_salt, password, cache=False)
+        except InvalidToken:
+            raise CLIError("Invalid password!!", EXIT_AUTH)
+
+        return self.key
+
+    def name_index(self):
+        '''
+            BlindIndex when the app names are encrypted
+            (asks for the 2nd password), None otherwise
+        '''
+        if not self.db_connect.names_encrypted(self.user_id):
+            return None
+
+        from blind_index import BlindIndex
+        return BlindIndex(self.secret_key())
+
+    def run(self):
+        self.login()
+        return getattr(self, f'cmd_{self.args.command}')()
+
+    def conds(self):
+        conds = {'user_id': self.user_id, 'app': self.args.app}
+        if self.args.username is not None:
+            conds['username'] = self.args.username
+        return conds
+
+    # Commands
+    def cmd_ls(self):
+        index = self.name_index()
+
+        if self.args.search is not None:
+            rows = self.db_connect.search(self.user_id, self.args.search, self.args.prefix, index=index)
+        else:
+            # read a page at a time, big vaults are never all in memory
+            pages = self.db_connect.pages(self.user_id, order='id', index=index)
+            rows = (row for page in pages for row in page)
+
+        if self.args.json:
+            print(json.dumps([
+                {"id": app_id, "app": app, "username": username} for app_id, app, username in rows
+            ]))
+            return
+
+        for app_id, app, username in rows:
+            print(f'{app_id}\t{app}\t{username}')
+
+    def cmd_get(self):
+        from sqlalchemy.exc import MultipleResultsFound
+        import secret_record
+        from vault_keys import DATA_KEY
+
+        key = self.secret_key()
+        rows = self.db_connect.select(cols=['app', 'username', 'secrets', 'key_version'], 
+            conds=self.conds(), index=self.name_index())
+
+        if len(rows) > 1:
+            raise MultipleResultsFound
+
+        app, username, token, key_version = rows[0]
+        if token is not None and key_version != DATA_KEY:
+            raise CLIError("The secrets of this app use another password, open it on the console.")
+
+        if self.args.field is not None:
+            # only that secret is decrypted
+            try:
+                if token is None or self.args.field < 1:
+                    raise IndexError(self.args.field)
+                print(secret_record.open_secrets(token, key, self.args.field - 1))
+            except IndexError:
+                raise CLIError(f'{app} has no secret {self.args.field}.', EXIT_NOT_FOUND)
+            return
+
+        secrets = secret_record.open_secrets(token, key) if token is not None else []
+
+        if self.args.json:
+            print(json.dumps({"app": app, "username": username, "secrets": secrets}))
+        else:
+            print("\n".join(secrets))
+
+    def cmd_add(self):
+        import secret_record
+        from importer import MAX_SECRETS
+
+        key = self.secret_key()
+        secrets = self.args.secret
+
+        if secrets is None:
+            secrets = [line.rstrip("\n") for line in sys.stdin] if not sys.stdin.isatty() else []
+
+        if len(secrets) > MAX_SECRETS:
+            raise CLIError(f'You can only pick {MAX_SECRETS} secrets.')
+
+        self.db_connect.insert({
+            'app': self.args.app,
+            'username': self.args.username or '',
+            'secrets': secret_record.seal(secrets, key) if secrets else None,
+            'user_id': self.user_id,
+        }, index=self.name_index())
+
+    def cmd_rm(self):
+        self.db_connect.delete_by_app(self.user_id, self.args.app, self.args.username, 
+            index=self.name_index())
+
+    def cmd_import(self):
+        from importer import Importer
+
+        key = self.secret_key()
+
+        def progress(rows, seconds):
+            print(f'\r{rows} rows ({rows / seconds if seconds else 0:.0f} rows/sec)', end="", file=sys.stderr)
+
+        importer = Importer(self.db_connect, self.user_id, key, index=self.name_index())
+        rows, seconds = importer.run(self.args.file, progress)
+        print("", file=sys.stderr)
+        print(f'{rows} apps imported in {seconds:.2f}s.')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="vault", description="Password vault")
+    parser.add_argument("--config", default="./files/db.ini")
+    parser.add_argument("--url", help="database url, instead of the config file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ls = commands.add_parser("ls", help="list the apps")
+    ls.add_argument("--json", action="store_true")
+    ls.add_argument("--search", help="only the apps with this text in the name")
+    ls.add_argument("--prefix", action="store_true", help="--search matches the start of the name")
+
+    get = commands.add_parser("get", help="show the secrets of an app")
+    get.add_argument("app")
+    get.add_argument("--username")
+    get.add_argument("--field", type=int, help="only secret number N (from 1)")
+    get.add_argument("--json", action="store_true")
+
+    add = commands.add_parser("add", help="add an app")
+    add.add_argument("app")
+    add.add_argument("--username")
+    add.add_argument("--secret", action="append", help="can be repeated, default: stdin lines")
+
+    rm = commands.add_parser("rm", help="delete an app")
+    rm.add_argument("app")
+    rm.add_argument("--username")
+
+    imp = commands.add_parser("import", help="import apps from a CSV or JSON file")
+    imp.add_argument("file")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from sqlalchemy.exc import NoResultFound, MultipleResultsFound
+    import instrument
+
+    instrument.from_env({"cli": VaultCLI})
+
+    try:
+        VaultCLI(args).run()
+    except CLIError as error:
+        print(error, file=sys.stderr)
+        return error.code
+    except NoResultFound:
+        print("No app was found with that name!", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    except MultipleResultsFound:
+        print("More than one app with that name, use --username.", file=sys.stderr)
+        return EXIT_ERROR
+    except Exception as error:
+        print(error, file=sys.stderr)
+        return EXIT_ERROR
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,362 @@
-# import qrcode
-from PIL import Image
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
-from base64 import urlsafe_b64encode
+# cryptography (and PIL for the QR codes) are imported on first
+# use, so commands that don't encrypt start faster
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from os import urandom
-from hashlib import scrypt
+from threading import Lock, BoundedSemaphore
+from hmac import compare_digest
+from time import monotonic
+from collections import OrderedDict
+from contextlib import contextmanager
+from struct import pack, unpack
+import io
+import mmap
+import os
+import shutil
+import tempfile
+
+from kdf import derive, DEFAULT as DEFAULT_KDF
+
+# Chunked file format
+FILE_MAGIC = b"PVF"
+FILE_VERSION = 1
+FILE_CHUNK_SIZE = 1024 * 1024 # 1 MiB
+# biggest chunk size a file can have, the header is only
+# authenticated with the first segment
+MAX_FILE_CHUNK_SIZE = 64 * 1024 * 1024
+# AES-GCM tag at the end of every segment
+FILE_TAG_SIZE = 16
+
+
+@contextmanager
+def atomic_writer(filename):
+    '''
+        Opens a temporary file next to filename
+        It replaces filename only if everything was written
+    '''
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            yield out
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _file_key(key):
+    '''
+        Derives the AES-GCM key used on files from a Fernet key
+        so the same key is never used by both formats
+    '''
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    from cryptography.hazmat.primitives.hashes import SHA256
+
+    hkdf = HKDF(SHA256(), 32, salt=None, info=b"vault-file-stream")
+    return hkdf.derive(urlsafe_b64decode(key))
+
+
+class EncryptedWriter(io.RawIOBase):
+    '''
+        Writes an encrypted stream to a file object in segments
+        of chunk_size, only one segment is kept in memory.
+
+        File format:
+            header -> magic, version, chunk size, nonce prefix
+            segments -> length + AES-GCM ciphertext
+        The nonce carries the segment counter and a flag on the 
+        last segment, so reordering or truncation is detected.
+
+        The last segment is written on close
+    '''
+    def __init__(self, file, key, chunk_size=FILE_CHUNK_SIZE):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        if not 0 < chunk_size <= MAX_FILE_CHUNK_SIZE:
+            raise ValueError(f'The chunk size must be between 1 and {MAX_FILE_CHUNK_SIZE} bytes.')
+
+        self.file = file
+        self.chunk_size = chunk_size
+        self.aead = AESGCM(_file_key(key))
+        self.prefix = urandom(7)
+        self.header = FILE_MAGIC + pack(">BI", FILE_VERSION, chunk_size) + self.prefix
+        self.counter = 0
+        self.buffer = bytearray()
+
+        self.file.write(self.header)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+
+        # a full segment is only sealed when more data follows it
+        while len(self.buffer) > self.chunk_size:
+            self._seal(bytes(self.buffer[:self.chunk_size]), False)
+            del self.buffer[:self.chunk_size]
+
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._seal(bytes(self.buffer), True)
+            self.buffer.clear()
+        super().close()
+
+    def _seal(self, chunk, last):
+        nonce = self.prefix + pack(">I?", self.counter, last)
+        sealed = self.aead.encrypt(nonce, chunk, self.header)
+        self.file.write(pack(">I", len(sealed)))
+        self.file.write(sealed)
+        self.counter += 1
+
+
+class EncryptedReader(io.RawIOBase):
+    '''
+        Reads a stream written by EncryptedWriter
+        Raises InvalidToken if the key is wrong or the stream
+        was changed or cut
+        A segment is never read past the chunk size of the
+        header, a changed length can't make it allocate more
+    '''
+    def __init__(self, file, key):
+        from cryptography.fernet import InvalidToken
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.file = file
+        self.header = file.read(len(FILE_MAGIC) + 5 + 7)
+
+        if not self.header.startswith(FILE_MAGIC):
+            raise InvalidToken
+
+        version, chunk_size = unpack(">BI", self.header[len(FILE_MAGIC):-7])
+        if version != FILE_VERSION or not 0 < chunk_size <= MAX_FILE_CHUNK_SIZE:
+            raise InvalidToken
+
+        self.max_segment = chunk_size + FILE_TAG_SIZE
+        self.aead = AESGCM(_file_key(key))
+        self.prefix = self.header[-7:]
+        self.counter = 0
+        self.finished = False
+        self.buffer = b""
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset == len(self.buffer):
+            if self.finished:
+                return 0
+            self._open_segment()
+
+        size = min(len(b), len(self.buffer) - self.offset)
+        b[:size] = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def _open_segment(self):
+        from cryptography.fernet import InvalidToken
+        from cryptography.exceptions import InvalidTag
+
+        size = self.file.read(4)
+        if len(size) != 4:
+            # the last segment never showed up
+            raise InvalidToken
+
+        size = unpack(">I", size)[0]
+        if size > self.max_segment:
+            raise InvalidToken
+
+        sealed = self.file.read(size)
+
+        # nothing after it means it is the last segment
+        last = not self.file.peek(1)
+
+        nonce = self.prefix + pack(">I?", self.counter, last)
+        try:
+            self.buffer = self.aead.decrypt(nonce, sealed, self.header)
+        except InvalidTag:
+            raise InvalidToken
+
+        self.offset = 0
+        self.counter += 1
+        self.finished = last
+
+
+class KeyCache:
+    '''
+        In-process cache for the derived keys used on the secrets
+        Keys are stored by (user_id, access_salt) so the scrypt
+        derivation is only paid once per unlock.
+
+        idle_timeout -> seconds without use before a key is dropped
+        ttl -> seconds after the unlock before a key is dropped
+    '''
+    def __init__(self, idle_timeout=300, ttl=1800):
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self._keys = {}
+        self._lock = Lock()
+
+    def get(self, user_id, salt):
+        '''
+            Returns the cached key or None if there is no key
+            or if it expired
+        '''
+        now = monotonic()
+
+        with self._lock:
+            entry = self._keys.get((user_id, bytes(salt)))
+            if entry is None:
+                return None
+
+            key, created, last_used = entry
+            if now - created > self.ttl or now - last_used > self.idle_timeout:
+                del self._keys[(user_id, bytes(salt))]
+                return None
+
+            self._keys[(user_id, bytes(salt))] = (key, created, now)
+            return key
+
+    def put(self, user_id, salt, key):
+        '''
+            Saves a key that was already checked against a token
+        '''
+        now = monotonic()
+        with self._lock:
+            self._keys[(user_id, bytes(salt))] = (key, now, now)
+
+    def lock(self, user_id):
+        '''
+            Drops all the keys of a user
+        '''
+        with self._lock:
+            for cache_key in [k for k in self._keys if k[0] == user_id]:
+                del self._keys[cache_key]
+
+    def clear(self):
+        '''
+            Drops every key
+        '''
+        with self._lock:
+            self._keys.clear()
+
+
+class Cipher:
+    '''
+        Reusable Fernet context for a single key
+        Avoids decoding the key and building Fernet on every token
+    '''
+    def __init__(self, key):
+        from cryptography.fernet import Fernet
+
+        self.fernet = Fernet(key)
+
+    def encrypt(self, data):
+        return self.fernet.encrypt(data)
+
+    def decrypt(self, token):
+        return self.fernet.decrypt(token)
+
+    def encrypt_many(self, items):
+        '''
+            Encrypts an iterable of bytes
+            Returns a list with the tokens in the same order
+        '''
+        encrypt = self.fernet.encrypt
+        return [encrypt(data) for data in items]
+
+    def decrypt_many(self, tokens):
+        '''
+            Decrypts an iterable of tokens
+            Returns a list with the data in the same order
+        '''
+        decrypt = self.fernet.decrypt
+        return [decrypt(bytes(token)) for token in tokens]
+
+
+class CipherCache:
+    '''
+        Small LRU of Cipher objects by key
+    '''
+    def __init__(self, size=32):
+        self.size = size
+        self._ciphers = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        key = bytes(key)
+
+        with self._lock:
+            cipher = self._ciphers.get(key)
+            if cipher is not None:
+                self._ciphers.move_to_end(key)
+                return cipher
+
+        # built outside the lock, Fernet checks the key 
+        cipher = Cipher(key)
+
+        with self._lock:
+            self._ciphers[key] = cipher
+            self._ciphers.move_to_end(key)
+            while len(self._ciphers) > self.size:
+                self._ciphers.popitem(last=False)
+
+        return cipher
+
+    def clear(self):
+        with self._lock:
+            self._ciphers.clear()
+
+
+class KDFPool:
+    '''
+        Bounded pool of threads for the scrypt work
+        (hashlib.scrypt releases the GIL while it runs)
+
+        workers -> hashes running at the same time
+        max_pending -> hashes running or waiting, more callers 
+            wait up to timeout seconds and then get TimeoutError
+        Each hash takes about 16 MB, so max_pending caps the memory
+    '''
+    def __init__(self, workers=4, max_pending=16, timeout=30):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        # made on the first hash, most commands never need it
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="kdf")
+            return self._executor
+
+    def run(self, func, *args):
+        '''
+            Runs func on the pool and waits for the result
+        '''
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Too many password checks running, try again later.")
+
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
 
-# Exception handling
-from cryptography.fernet import InvalidToken
 
 class Encrypt:
     '''
@@ -15,10 +364,27 @@ class Encrypt:
         interactive login: N=16384, r=8, p=1 (RAM = 2 MB).
         file encryption: N=1048576, r=8, p=1 (RAM = 1 GB)
     '''
+    key_cache = KeyCache()
+    cipher_cache = CipherCache()
+    kdf_pool = KDFPool()
+    # KDF of new login hashes, [login] kdf of the configuration
+    login_kdf = DEFAULT_KDF
+
     @staticmethod
     def gen_qr_code():
+        # PIL is only loaded when a QR code is asked for
+        # from PIL import Image
+        # import qrcode
         ...
     
+    @staticmethod
+    def cipher(key):
+        '''
+            Returns a reusable Cipher for the key
+            use it for loops with encrypt_many/decrypt_many
+        '''
+        return Encrypt.cipher_cache.get(key)
+
     @staticmethod
     def encrypt(data, key):
         '''
@@ -26,8 +392,7 @@ class Encrypt:
             data must be bytes
             Return the token
         '''
-        f = Fernet(key)
-        token = f.encrypt(data)
+        token = Encrypt.cipher(key).encrypt(data)
         return token
       
     @staticmethod
@@ -36,43 +401,52 @@ class Encrypt:
             Decrypts a token with a key
             Returns the data
         '''
-        f = Fernet(key)
-        data = f.decrypt(token)
+        data = Encrypt.cipher(key).decrypt(token)
         return data
     
     @staticmethod
-    def encrypt_file(filename, key):
+    def encrypt_file(filename, key, chunk_size=FILE_CHUNK_SIZE, use_mmap=False):
         '''
             Encrypts a file with a key
-            Saves the token on the file
+            The file is read and written in segments of chunk_size
+            (see EncryptedWriter) so the memory used doesn't depend 
+            on the file size.
+
+            The result is written to a temporary file and renamed
+            over the original one.
         '''
-        data = None
-        with open(filename, 'rb') as file:
-            data = file.read() 
-        
-        with open(filename, 'wb') as file:
-            token = Encrypt.encrypt(data, key)
-            file.write(token)
+        with open(filename, 'rb') as file, atomic_writer(filename) as out:
+            size = os.fstat(file.fileno()).st_size
+
+            with EncryptedWriter(out, key, chunk_size) as writer:
+                if use_mmap and size:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        for offset in range(0, size, chunk_size):
+                            writer.write(mapped[offset:offset + chunk_size])
+                else:
+                    shutil.copyfileobj(file, writer, chunk_size)
      
     @staticmethod
     def decrypt_file(filename, key):
         '''
             Decrypts a file with a key
             Write the data back to the file
-        '''
-        token = None
-        data = None
 
+            Files made by the old whole file Fernet format
+            are still accepted
+        '''
         with open(filename, 'rb') as file:
-            # Read the token from the file
-            token = file.read()
-        
-        data = Encrypt.decrypt(token, key)
-            
-        with open(filename, 'wb') as file:
-            # Decrypt the token and write it back
+            if file.peek(len(FILE_MAGIC))[:len(FILE_MAGIC)] != FILE_MAGIC:
+                # Read the token from the file (old format)
+                data = Encrypt.decrypt(file.read(), key)
+
+                with atomic_writer(filename) as out:
+                    out.write(data)
+                return
 
-            file.write(data)
+            with atomic_writer(filename) as out:
+                reader = EncryptedReader(file, key)
+                shutil.copyfileobj(reader, out, FILE_CHUNK_SIZE)
 
     @staticmethod
     def gen_random_key():
@@ -80,17 +454,35 @@ class Encrypt:
             Generates a random key with Fernet
             -> change for Scrypt
         '''
+        from cryptography.fernet import Fernet
+
         return Fernet.generate_key() 
 
     @staticmethod
-    def gen_pass_key(password):
+    def wrap_key(data_key, key):
+        '''
+            Encrypts a data key with a password key
         '''
-            Generates a Scrypt key encoded with base64
+        return Encrypt.encrypt(data_key, key)
+
+    @staticmethod
+    def unwrap_key(wrapped_key, key):
+        '''
+            Decrypts a data key with a password key
+            Raises InvalidToken if the password is wrong
+        '''
+        return Encrypt.decrypt(wrapped_key, key)
+
+    @staticmethod
+    def gen_pass_key(password, kdf=None):
+        '''
+            Generates a key encoded with base64
+            kdf -> parameters of the kdf module, default scrypt
             returns the key with the salt used
         '''
         salt = Encrypt.get_random_salt()
-        kdf = Scrypt(salt, 32, n=16384, r=8, p=1)
-        key = urlsafe_b64encode(kdf.derive(password.encode()))
+        # same KDF as get_hash, so login can check it
+        key = Encrypt.get_hash(password, salt, kdf)
         return [key, salt]
 
     @staticmethod
@@ -101,16 +493,58 @@ class Encrypt:
         return  urlsafe_b64encode( urandom(16) )
     
     @staticmethod
-    def get_hash(password, salt):
+    def get_hash(password, salt, kdf=None):
         '''
             Hashes a password with a salt encoded with base64
-            using hashlib module, with algo scrypt
-            default derived key length is 16
+            kdf -> parameters of the kdf module, default is
+                scrypt N=16384, r=8, p=1 (the secret password 
+                always uses it)
             salt is already encoded, it comes from the database
         '''
-        hashed = scrypt(password.encode(), salt=salt, dklen=32, n=16384, r=8, p=1)
-        hashed = urlsafe_b64encode(hashed)
-        return hashed
+        return derive(password, salt, kdf)
+
+    @staticmethod
+    def set_kdf_pool(workers=4, max_pending=16, timeout=30):
+        '''
+            Replaces the KDF pool if the settings changed
+        '''
+        pool = Encrypt.kdf_pool
+        if (pool.workers, pool.max_pending, pool.timeout) == (workers, max_pending, timeout):
+            return
+
+        Encrypt.kdf_pool = KDFPool(workers, max_pending, timeout)
+        pool.shutdown(wait=False)
+
+    @staticmethod
+    def verify_password(password, salt, hashed, kdf=None):
+        '''
+            Hashes the password on the KDF pool and compares it 
+            with the saved hash in constant time
+        '''
+        new_hash = Encrypt.kdf_pool.run(Encrypt.get_hash, password, salt, kdf)
+        return compare_digest(new_hash, hashed)
+
+    @staticmethod
+    def get_cached_key(user_id, salt):
+        '''
+            Returns the derived key of an unlocked user
+            or None if the user has to type the password again
+        '''
+        return Encrypt.key_cache.get(user_id, salt)
+
+    @staticmethod
+    def lock(user_id=None):
+        '''
+            Forgets the cached keys of a user
+            or of everyone if no user is given
+        '''
+        if user_id is None:
+            Encrypt.key_cache.clear()
+        else:
+            Encrypt.key_cache.lock(user_id)
+
+        # the ciphers hold the keys as well
+        Encrypt.cipher_cache.clear()
 
 if __name__ == "__main__":
     key, salt = Encrypt.gen_pass_key("narutokunandhinata")
@@ -0,0 +1,189 @@
+'''
+    Bulk import of apps into the vault from CSV or JSON files
+
+    CSV -> header with app, username and secret1..secret4 
+           (or a single secrets column)
+    JSON -> a list of objects or one object per line (.jsonl)
+            with app, username and secrets (list)
+
+    All of them are streamed, the list of a .json file is read
+    one object at a time
+'''
+import csv
+import json
+import os
+from itertools import islice
+from time import perf_counter
+
+import secret_record
+
+MAX_SECRETS = 4
+
+# characters read at a time from a .json file
+JSON_CHUNK = 64 * 1024
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK):
+    '''
+        Yields the items of the top level list of a JSON file
+        without reading the whole file
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def more():
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    def skip(chars):
+        # moves past the chars, reading more when the buffer ends
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or not more():
+                return
+
+    skip(' \t\r\n')
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError('A .json file must have a list of rows')
+    pos += 1
+
+    first = True
+    while True:
+        skip(' \t\r\n')
+        if buffer[pos:pos + 1] == ']':
+            return
+        if not first:
+            if buffer[pos:pos + 1] != ',':
+                raise ValueError(f'Invalid JSON list near: {buffer[pos:pos + 40]!r}')
+            pos += 1
+            skip(' \t\r\n')
+        first = False
+
+        # numbers, true, false and null only end at the next , or ]
+        if buffer[pos:pos + 1] not in ('{', '[', '"'):
+            while ',' not in buffer[pos:] and ']' not in buffer[pos:] and more():
+                pass
+
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                if not more():
+                    raise
+
+        pos = end
+        yield item
+
+
+def read_rows(filename):
+    '''
+        Yields the rows of the file as dictionaries
+        CSV and JSON lines are streamed
+    '''
+    ext = os.path.splitext(filename)[1].lower()
+
+    with open(filename, newline='', encoding='utf-8') as file:
+        if ext == '.csv':
+            yield from csv.DictReader(file)
+        elif ext in ('.jsonl', '.ndjson'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif ext == '.json':
+            yield from iter_json_array(file)
+        else:
+            raise ValueError(f'Unsupported file type {ext}')
+
+
+def get_secrets(row):
+    '''
+        Returns the list of secrets of a row
+    '''
+    secrets = row.get('secrets')
+
+    if secrets is None:
+        secrets = [row.get(f'secret{i+1}') for i in range(MAX_SECRETS)]
+        secrets = [s for s in secrets if s not in (None, '')]
+    elif isinstance(secrets, str):
+        secrets = [secrets]
+
+    if len(secrets) > MAX_SECRETS:
+        raise ValueError(f'{row.get("app")}: you can only have {MAX_SECRETS} secrets.')
+
+    return secrets
+
+
+class Importer:
+    '''
+        Streams the rows of a file, encrypts the secrets
+        and writes them in batches
+        The secrets are sealed in this thread: Fernet holds
+        the GIL, so a pool of threads was slower than this
+
+        db_connect -> DBConnect
+        key -> data key of the account (vault_keys.unlock_secrets)
+        index -> BlindIndex when the app names are encrypted
+    '''
+    def __init__(self, db_connect, user_id, key, batch_size=500, index=None):
+        self.db_connect = db_connect
+        self.user_id = user_id
+        self.key = key
+        self.index = index
+        self.batch_size = batch_size
+
+    def build_row(self, row):
+        '''
+            Turns a row from the file into a vault row
+        '''
+        app = row.get('app')
+        if not app:
+            raise ValueError(f'Row without app name: {row}')
+
+        secrets = get_secrets(row)
+        content = {
+            'app': app,
+            'username': row.get('username') or '',
+            'secrets': None,
+            'user_id': self.user_id,
+        }
+
+        if secrets:
+            content['secrets'] = secret_record.seal(secrets, self.key)
+
+        return content
+
+    def run(self, filename, progress=None):
+        '''
+            Imports the file
+            progress -> called after each batch with (rows, seconds)
+            Returns (rows, seconds)
+        '''
+        rows = read_rows(filename)
+        total = 0
+        start = perf_counter()
+
+        while True:
+            batch = [self.build_row(row) for row in islice(rows, self.batch_size)]
+            if not batch:
+                break
+
+            total += self.db_connect.insert_many(batch, index=self.index)
+
+            if progress:
+                progress(total, perf_counter() - start)
+
+        return total, perf_counter() - start
+
+
+def print_progress(rows, seconds):
+    rate = rows / seconds if seconds else 0
+    print(f'\r{rows} rows imported ({rate:.0f} rows/sec)', end="", flush=True)
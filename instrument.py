@@ -0,0 +1,245 @@
+'''
+    Opt-in timings of the hot paths
+
+    Nothing is measured unless it is turned on, then the methods
+    of DBConnect, Encrypt, Cipher and KDFPool (and of the classes
+    an entry point adds, like VaultApp) are wrapped to record
+    their time, the SQL statements are timed with SQLAlchemy
+    events and the pool checkouts are timed as well.
+
+        VAULT_METRICS=1            summary of the timings on exit
+        VAULT_METRICS_FILE=path    Prometheus text format on exit
+        VAULT_PROFILE=path         cProfile of the whole run (pstats file)
+
+    The console actions include the time spent at the prompts.
+'''
+import atexit
+import functools
+import inspect
+import os
+import sys
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from time import perf_counter
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# durations kept per operation for the percentiles of the summary
+SAMPLES = 10000
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1) # the last one is +Inf
+        self.samples = deque(maxlen=SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.samples.append(seconds)
+
+    def percentile(self, percent):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+class Metrics:
+    '''
+        Histograms of durations by operation name
+    '''
+    def __init__(self):
+        self.histograms = {}
+        self._lock = Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def summary(self):
+        '''
+            Table of the operations, the slowest in total first
+        '''
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda item: -item[1].total)
+
+            lines = [f'{"operation":36}{"count":>8}{"total ms":>12}{"mean ms":>10}'
+                f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}']
+            for name, h in items:
+                lines.append(f'{name:36}{h.count:8}{h.total * 1e3:12.1f}{h.total / h.count * 1e3:10.3f}'
+                    f'{h.percentile(50) * 1e3:10.3f}{h.percentile(95) * 1e3:10.3f}'
+                    f'{h.percentile(99) * 1e3:10.3f}{h.max * 1e3:10.3f}')
+
+        return "\n".join(lines)
+
+    def prometheus(self):
+        '''
+            Text exposition format of Prometheus
+        '''
+        lines = [
+            "# HELP vault_operation_seconds Duration of the vault operations",
+            "# TYPE vault_operation_seconds histogram",
+        ]
+
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), h.buckets):
+                    cumulative += count
+                    lines.append(f'vault_operation_seconds_bucket{{op="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'vault_operation_seconds_sum{{op="{name}"}} {h.total:.6f}')
+                lines.append(f'vault_operation_seconds_count{{op="{name}"}} {h.count}')
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+enabled = False
+_profiler = None
+
+
+def timed(name, func):
+    '''
+        Wraps a function to record its time as name
+        Generators are timed until they are exhausted
+    '''
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator(*args, **kwargs):
+            start = perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            finally:
+                metrics.observe(name, perf_counter() - start)
+        return generator
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe(name, perf_counter() - start)
+    return wrapper
+
+
+def instrument_class(cls, prefix, names=None):
+    '''
+        Wraps the public methods of a class (or only names)
+        Static and class methods keep their kind
+    '''
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or (names is not None and attr not in names):
+            continue
+
+        if isinstance(value, staticmethod):
+            setattr(cls, attr, staticmethod(timed(f'{prefix}.{attr}', value.__func__)))
+        elif isinstance(value, classmethod):
+            setattr(cls, attr, classmethod(timed(f'{prefix}.{attr}', value.__func__)))
+        elif inspect.isfunction(value):
+            setattr(cls, attr, timed(f'{prefix}.{attr}', value))
+
+
+def instrument_sql():
+    '''
+        Times every statement (sql.select, sql.insert, ...)
+        and every checkout of a pooled connection
+    '''
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.pool import Pool
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context.vault_start = perf_counter()
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.split(None, 1)[0].lower() if statement.strip() else "other"
+        metrics.observe(f'sql.{verb}', perf_counter() - context.vault_start)
+
+    Pool.connect = timed("pool.checkout", Pool.connect)
+
+
+def enable(classes=None):
+    '''
+        Turns the timings on
+        classes -> more {prefix: class} to time, like {"app": VaultApp}
+            or {prefix: (class, names of the methods)}
+    '''
+    global enabled
+    if enabled:
+        return
+    enabled = True
+
+    from db_handler import DBConnect
+    from encrypt import Encrypt, Cipher, KDFPool
+
+    instrument_class(DBConnect, "db")
+    instrument_class(Encrypt, "encrypt")
+    instrument_class(Cipher, "cipher")
+    instrument_class(KDFPool, "kdf_pool", ["run"])
+    instrument_sql()
+
+    for prefix, cls in (classes or {}).items():
+        if isinstance(cls, tuple):
+            instrument_class(cls[0], prefix, cls[1])
+        else:
+            instrument_class(cls, prefix)
+
+
+def start_profile():
+    global _profiler
+    import cProfile
+
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+
+
+def report(path=None, summary=True, out=sys.stderr):
+    '''
+        Prints the summary and writes the Prometheus dump to path
+    '''
+    if summary and metrics.histograms:
+        print(metrics.summary(), file=out)
+
+    if path:
+        with open(path, "w") as file:
+            file.write(metrics.prometheus())
+
+
+def stop_profile(path):
+    _profiler.disable()
+    _profiler.dump_stats(path)
+    print(f'Profile saved to {path} (python -m pstats {path})', file=sys.stderr)
+
+
+def from_env(classes=None):
+    '''
+        Turns on what the environment asks for
+        Called by the entry points before they start
+    '''
+    if os.environ.get("VAULT_METRICS") or os.environ.get("VAULT_METRICS_FILE"):
+        enable(classes)
+        atexit.register(report, os.environ.get("VAULT_METRICS_FILE"), bool(os.environ.get("VAULT_METRICS")))
+
+    profile = os.environ.get("VAULT_PROFILE")
+    if profile:
+        start_profile()
+        atexit.register(stop_profile, profile)
@@ -0,0 +1,161 @@
+'''
+    Password hashing parameters of the logins
+
+    The algorithm and its parameters are saved on each account
+    (account.kdf) as a short text:
+
+        scrypt$n=16384,r=8,p=1
+        argon2id$t=3,m=65536,p=4     (m in KiB, needs argon2-cffi)
+
+    Accounts without it use DEFAULT, the scrypt of the first
+    versions. New hashes use the [login] kdf of the configuration
+    and older hashes are rehashed with it after a good login.
+
+    calibrate picks the parameters for a target time and memory
+    on this machine:
+
+        python kdf.py --target-ms 250 --max-memory 64 [--argon2id]
+'''
+import argparse
+import os
+from base64 import urlsafe_b64encode
+from hashlib import scrypt
+from time import perf_counter
+
+DEFAULT = "scrypt$n=16384,r=8,p=1"
+KEY_SIZE = 32
+
+# the default is the lowest cost calibrate goes to
+MIN_SCRYPT_N = 2 ** 14
+MIN_ARGON2_MEMORY = 19 * 1024 # KiB
+
+
+def parse(spec):
+    '''
+        "scrypt$n=16384,r=8,p=1" -> ("scrypt", {"n": 16384, "r": 8, "p": 1})
+    '''
+    try:
+        algorithm, params = (spec or DEFAULT).split("$", 1)
+        params = {name: int(value) for name, value in (item.split("=") for item in params.split(","))}
+    except ValueError:
+        raise Exception(f'Invalid KDF parameters {spec}.')
+
+    if algorithm not in ALGORITHMS:
+        raise Exception(f'Unknown KDF {algorithm}.')
+
+    return algorithm, params
+
+
+def format_spec(algorithm, **params):
+    return algorithm + "$" + ",".join(f'{name}={value}' for name, value in params.items())
+
+
+def scrypt_hash(password, salt, n, r, p):
+    # hashlib refuses more than 32 MiB unless maxmem is raised
+    maxmem = 2 * 128 * n * r * p + 1024 * 1024
+    return scrypt(password, salt=salt, dklen=KEY_SIZE, n=n, r=r, p=p, maxmem=maxmem)
+
+
+def argon2_hash(password, salt, t, m, p):
+    try:
+        from argon2.low_level import hash_secret_raw, Type
+    except ImportError:
+        raise Exception("Argon2id needs the argon2-cffi package.")
+
+    return hash_secret_raw(password, salt, time_cost=t, memory_cost=m,
+        parallelism=p, hash_len=KEY_SIZE, type=Type.ID)
+
+
+ALGORITHMS = {
+    'scrypt': scrypt_hash,
+    'argon2id': argon2_hash,
+}
+
+
+def derive(password, salt, spec=None):
+    '''
+        Hashes a password (str) with a salt (bytes)
+        Returns the hash encoded with base64
+    '''
+    algorithm, params = parse(spec)
+    return urlsafe_b64encode(ALGORITHMS[algorithm](password.encode(), salt, **params))
+
+
+def memory(spec):
+    '''
+        Bytes of memory a hash takes
+    '''
+    algorithm, params = parse(spec)
+    if algorithm == 'scrypt':
+        return 128 * params['n'] * params['r'] * params['p']
+    return params['m'] * 1024
+
+
+def timed(spec, runs=3):
+    '''
+        Best time of a hash in seconds
+    '''
+    salt = os.urandom(16)
+    best = None
+
+    for _ in range(runs):
+        start = perf_counter()
+        derive("calibration password", salt, spec)
+        took = perf_counter() - start
+        best = took if best is None else min(best, took)
+
+    return best
+
+
+def calibrate(target_ms=250, max_memory=64, algorithm='scrypt'):
+    '''
+        Parameters as costly as possible that still hash in
+        about target_ms on this machine within max_memory MiB
+        Never goes below the cost of DEFAULT
+    '''
+    target = target_ms / 1000
+    budget = max_memory * 1024 * 1024
+
+    if algorithm == 'scrypt':
+        spec = format_spec('scrypt', n=MIN_SCRYPT_N, r=8, p=1)
+        # n doubles the time and the memory
+        while True:
+            bigger = format_spec('scrypt', n=parse(spec)[1]['n'] * 2, r=8, p=1)
+            if memory(bigger) > budget or timed(bigger) > target:
+                return spec
+            spec = bigger
+
+    if algorithm == 'argon2id':
+        lanes = min(os.cpu_count() or 1, 4)
+        m = max(MIN_ARGON2_MEMORY, budget // 1024)
+        spec = format_spec('argon2id', t=1, m=m, p=lanes)
+
+        # less memory until one pass fits, then more passes
+        while timed(spec) > target and m > MIN_ARGON2_MEMORY:
+            m = max(MIN_ARGON2_MEMORY, m // 2)
+            spec = format_spec('argon2id', t=1, m=m, p=lanes)
+
+        t = 1
+        while True:
+            bigger = format_spec('argon2id', t=t + 1, m=m, p=lanes)
+            if timed(bigger) > target:
+                return spec
+            spec, t = bigger, t + 1
+
+    raise Exception(f'Unknown KDF {algorithm}.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Picks the KDF parameters for [login] kdf")
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--max-memory", type=int, default=64, help="MiB per hash")
+    parser.add_argument("--argon2id", action="store_true")
+    args = parser.parse_args()
+
+    spec = calibrate(args.target_ms, args.max_memory, 'argon2id' if args.argon2id else 'scrypt')
+    print(f'kdf = {spec}')
+    print(f'# {timed(spec) * 1000:.0f} ms, {memory(spec) / 1024 / 1024:.0f} MiB per hash')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+'''
+    Versioned schema migrations
+
+    The version of the schema is kept on the schema_version table.
+    On startup it is read with a single query, and only the 
+    migrations after it are run, each one in its own transaction.
+
+    A migration is (version, description, function) and the 
+    function gets (conn, metadata) with the tables of DBConnect.
+    New migrations are appended to MIGRATIONS.
+'''
+from sqlalchemy import Table, Column, Integer, MetaData, inspect, select, delete, insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+VERSION_META = MetaData()
+VERSION_TABLE = Table(
+    "schema_version", VERSION_META,
+    Column("version", Integer, nullable=False),
+)
+
+
+def create_tables(conn, metadata):
+    '''
+        Creates the tables that don't exist yet
+        (databases from before the migrations already have them)
+    '''
+    metadata.create_all(conn, checkfirst=True)
+
+
+def add_data_key_columns(conn, metadata):
+    '''
+        account.wrapped_key and vault.key_version
+    '''
+    add_column(conn, metadata.tables['account'], 'wrapped_key')
+    add_column(conn, metadata.tables['vault'], 'key_version', 'NOT NULL DEFAULT 0')
+
+
+def create_vault_indexes(conn, metadata):
+    '''
+        Indexes of the vault for tables made before them
+    '''
+    create_indexes(conn, metadata.tables['vault'],
+        ['ix_vault_user_id', 'ix_vault_user_id_app', 'ix_vault_user_id_lower_app'])
+
+
+def add_blind_index(conn, metadata):
+    '''
+        Columns and table of the encrypted names (blind_index)
+    '''
+    vault = metadata.tables['vault']
+
+    add_column(conn, metadata.tables['account'], 'names_encrypted', 'NOT NULL DEFAULT 0')
+    for name in ('names', 'app_index', 'username_index'):
+        add_column(conn, vault, name)
+
+    metadata.tables['vault_gram'].create(conn, checkfirst=True)
+    create_indexes(conn, vault, ['ix_vault_user_id_app_index'])
+
+
+def add_kdf_column(conn, metadata):
+    '''
+        account.kdf, the rows before it use kdf.DEFAULT
+    '''
+    add_column(conn, metadata.tables['account'], 'kdf')
+
+
+MIGRATIONS = [
+    (1, "base tables", create_tables),
+    (2, "data key columns", add_data_key_columns),
+    (3, "vault indexes", create_vault_indexes),
+    (4, "blind index of the names", add_blind_index),
+    (5, "kdf of the logins", add_kdf_column),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def add_column(conn, table, name, extra=""):
+    '''
+        ALTER TABLE ADD COLUMN for a column of the table definition
+        Does nothing if the column is already there
+    '''
+    columns = [col['name'] for col in inspect(conn).get_columns(table.name)]
+    if name in columns:
+        return
+
+    col_type = table.c[name].type.compile(conn.dialect)
+    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {name} {col_type} {extra}'.strip())
+
+
+def create_indexes(conn, table, names=None):
+    '''
+        Creates the indexes of the table that don't exist
+        names -> only these indexes, migrations must not create
+            the indexes of columns added after them
+        expression indexes can't be reflected, so IF NOT EXISTS is used
+    '''
+    for index in table.indexes:
+        if names is not None and index.name not in names:
+            continue
+        ddl = str(CreateIndex(index).compile(conn))
+        conn.exec_driver_sql(ddl.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+
+
+def get_version(engine):
+    '''
+        Returns the version of the schema
+        0 if the database has no schema_version table
+    '''
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(VERSION_TABLE.c.version)).scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+def apply_one(conn, metadata, number, func):
+    '''
+        Runs a migration and saves its version
+    '''
+    func(conn, metadata)
+    conn.execute(delete(VERSION_TABLE))
+    conn.execute(insert(VERSION_TABLE).values(version=number))
+
+
+def apply(conn, metadata, version):
+    '''
+        Runs the migrations after version on a connection
+        Returns the new version
+    '''
+    for number, description, func in MIGRATIONS:
+        if number > version:
+            apply_one(conn, metadata, number, func)
+            version = number
+
+    return version
+
+
+def migrate(engine, metadata):
+    '''
+        Runs the migrations after the version of the database
+        each one in its own transaction
+        Returns the version of the database
+    '''
+    version = get_version(engine)
+    if version >= LATEST:
+        return version
+
+    VERSION_META.create_all(engine, checkfirst=True)
+
+    for number, description, func in MIGRATIONS:
+        if number <= version:
+            continue
+
+        with engine.begin() as conn:
+            apply_one(conn, metadata, number, func)
+
+        version = number
+
+    return version
+
+
+def migrate_connection(conn, metadata):
+    '''
+        Same as migrate but on a single connection in one 
+        transaction, for the async engine (run_sync)
+    '''
+    if not inspect(conn).has_table(VERSION_TABLE.name):
+        VERSION_META.create_all(conn)
+        version = 0
+    else:
+        version = conn.execute(select(VERSION_TABLE.c.version)).scalar() or 0
+
+    if version >= LATEST:
+        return version
+
+    return apply(conn, metadata, version)
@@ -0,0 +1,101 @@
+'''
+    Binary record of the secrets of an app
+
+    Each secret is encrypted on its own, so one secret can be
+    read without decrypting the others, and any character
+    (commas included) can be part of a secret.
+
+    Record format (version 1):
+        magic "VS" | version (1 byte) | count (1 byte)
+        then for each secret: length (4 bytes) | Fernet token
+
+    Rows from before the record are a single Fernet token of the
+    secrets joined with ",", they are still read by open_secrets and are
+    written as a record the next time they change.
+'''
+from struct import pack, unpack, calcsize
+
+from encrypt import Encrypt
+
+MAGIC = b"VS"
+VERSION = 1
+HEADER = ">2sBB"
+LENGTH = ">I"
+
+
+def is_record(data):
+    '''
+        False for the old comma joined token
+    '''
+    return data is not None and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def seal(secrets, key):
+    '''
+        Encrypts a list of secrets (str) into a record
+    '''
+    if len(secrets) > 255:
+        raise ValueError("Too many secrets for a record.")
+
+    cipher = Encrypt.cipher(key)
+    parts = [pack(HEADER, MAGIC, VERSION, len(secrets))]
+
+    for secret in secrets:
+        token = cipher.encrypt(secret.encode("utf-8"))
+        parts.append(pack(LENGTH, len(token)))
+        parts.append(token)
+
+    return b"".join(parts)
+
+
+def tokens(record):
+    '''
+        Returns the encrypted fields of a record
+        without decrypting them
+    '''
+    record = memoryview(bytes(record))
+    magic, version, fields_count = unpack(HEADER, record[:calcsize(HEADER)])
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unknown secrets record.")
+
+    fields = []
+    offset = calcsize(HEADER)
+    for _ in range(fields_count):
+        (length,) = unpack(LENGTH, record[offset:offset + calcsize(LENGTH)])
+        offset += calcsize(LENGTH)
+        fields.append(record[offset:offset + length])
+        offset += length
+
+    return fields
+
+
+def open_secrets(data, key, index=None):
+    '''
+        Decrypts the secrets of a row
+        index -> only that secret (from 0) is decrypted
+        Returns the list of secrets, or the secret at index
+        Raises IndexError if there is no secret at index
+    '''
+    cipher = Encrypt.cipher(key)
+
+    if not is_record(data):
+        # old format, all the secrets in one token
+        secrets = cipher.decrypt(bytes(data)).decode("utf-8").split(",")
+        return secrets if index is None else secrets[index]
+
+    fields = tokens(data)
+    if index is not None:
+        return cipher.decrypt(bytes(fields[index])).decode("utf-8")
+
+    return [secret.decode("utf-8") for secret in cipher.decrypt_many(fields)]
+
+
+def count(data):
+    '''
+        Number of secrets of a record, without decrypting
+        None for the old format
+    '''
+    if not is_record(data):
+        return None
+    return unpack(HEADER, bytes(data[:calcsize(HEADER)]))[2]
@@ -0,0 +1,406 @@
+'''
+    Headless JSON service of the vault (stdlib http.server)
+
+        python service.py [--host 127.0.0.1] [--port 8080] [--url sqlite://]
+
+    Endpoints (after /login send "Authorization: Bearer <token>"):
+        POST   /login                {username, password} -> {token}
+        POST   /unlock               {password} 2nd password of the secrets
+        POST   /lock
+        POST   /logout
+        GET    /apps                 -> [{id, app, username}]
+                                     ?search=text (&prefix=1) apps with text in the name
+        GET    /apps/<app>           -> {app, username, secrets}
+                                     ?field=N only secret N (from 1) -> {app, username, secret}
+        POST   /apps                 {app, username, secrets: [...]}
+        PUT    /apps/<app>           {app?, username?, secrets?}
+        DELETE /apps/<app>
+        GET    /metrics              timings in Prometheus text format,
+                                     with VAULT_METRICS set (instrument)
+    ?username=<name> picks the app when more than one has the same name
+
+    Sessions and their data keys only live in memory and expire
+    after idle_timeout seconds without use or ttl seconds.
+    When the app names of the account are encrypted every /apps
+    endpoint needs /unlock.
+'''
+import argparse
+import json
+import secrets as token_gen
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy.exc import NoResultFound, MultipleResultsFound
+
+from db_handler import DBConnect
+import secret_record
+from blind_index import BlindIndex
+import instrument
+from vault_keys import unlock_secrets, DATA_KEY
+
+MAX_SECRETS = 4
+
+# handler methods timed by instrument
+ENDPOINTS = ["login", "unlock", "lock", "logout", "list_apps", 
+    "get_app", "add_app", "edit_app", "delete_app"]
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Session:
+    def __init__(self, user_id, salt, names_encrypted=False):
+        self.user_id = user_id
+        self.salt = salt
+        self.names_encrypted = names_encrypted
+        self.data_key = None
+        self.index = None
+        self.created = monotonic()
+        self.last_used = self.created
+
+
+class SessionStore:
+    '''
+        Sessions by token with idle and absolute expiry
+    '''
+    def __init__(self, idle_timeout=300, ttl=3600):
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = Lock()
+
+    def new(self, user_id, salt, names_encrypted=False):
+        token = token_gen.token_urlsafe(32)
+        with self._lock:
+            self._expire(monotonic())
+            self._sessions[token] = Session(user_id, salt, names_encrypted)
+        return token
+
+    def get(self, token):
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(token)
+            if session is not None:
+                session.last_used = now
+            return session
+
+    def drop(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def _expire(self, now):
+        for token, session in list(self._sessions.items()):
+            if now - session.created > self.ttl or now - session.last_used > self.idle_timeout:
+                del self._sessions[token]
+
+
+class VaultService(ThreadingHTTPServer):
+    '''
+        HTTP server with the DBConnect and the sessions
+        shared by every request thread
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, db_connect, sessions=None):
+        super().__init__(address, VaultHandler)
+        self.db_connect = db_connect
+        self.sessions = sessions or SessionStore()
+
+
+class VaultHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    disable_nagle_algorithm = True # headers and body are separate writes
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    # Plumbing
+    def dispatch(self, method):
+        parts = urlsplit(self.path)
+        path = [unquote(part) for part in parts.path.strip("/").split("/") if part]
+        self.query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+        routes = {
+            ("POST", "login"): self.login,
+            ("POST", "unlock"): self.unlock,
+            ("POST", "lock"): self.lock,
+            ("POST", "logout"): self.logout,
+            ("GET", "apps"): self.list_apps,
+            ("GET", "metrics"): self.metrics,
+            ("POST", "apps"): self.add_app,
+        }
+        app_routes = {
+            "GET": self.get_app,
+            "PUT": self.edit_app,
+            "DELETE": self.delete_app,
+        }
+
+        try:
+            body = self.read_body()
+
+            if len(path) == 1 and (method, path[0]) in routes:
+                status, result = routes[(method, path[0])](body)
+            elif len(path) == 2 and path[0] == "apps" and method in app_routes:
+                status, result = app_routes[method](path[1], body)
+            else:
+                raise HTTPError(404, "Not found")
+
+        except HTTPError as error:
+            status, result = error.status, {"error": error.message}
+        except NoResultFound:
+            status, result = 404, {"error": "No app was found with that name!"}
+        except MultipleResultsFound:
+            status, result = 409, {"error": "More than one app with that name, add ?username="}
+        except InvalidToken:
+            status, result = 403, {"error": "Invalid password!!"}
+        except TimeoutError as error:
+            status, result = 503, {"error": str(error)}
+        except Exception as error:
+            status, result = 500, {"error": str(error)}
+
+        if isinstance(result, str):
+            self.send_text(status, result)
+        else:
+            self.send_json(status, result)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON")
+
+        if not isinstance(body, dict):
+            raise HTTPError(400, "The body must be an object")
+        return body
+
+    def send_json(self, status, result):
+        data = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_text(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def session(self, unlocked=False):
+        session = self.server.sessions.get(self.token())
+        if session is None:
+            raise HTTPError(401, "Login required")
+        if unlocked and session.data_key is None:
+            raise HTTPError(403, "Secrets are locked, POST /unlock first")
+
+        return session
+
+    def app_session(self):
+        '''
+            Session of the /apps endpoints that don't read secrets
+            the data key is needed when the app names are encrypted
+        '''
+        session = self.session()
+        if session.names_encrypted and session.data_key is None:
+            raise HTTPError(403, "App names are encrypted, POST /unlock first")
+
+        return session
+
+    def token(self):
+        auth = self.headers.get("Authorization", "")
+        return auth[len("Bearer "):] if auth.startswith("Bearer ") else ""
+
+    def field(self, body, name, required=True):
+        value = body.get(name)
+        if required and not isinstance(value, str):
+            raise HTTPError(400, f'"{name}" is required')
+        return value
+
+    @property
+    def db(self):
+        return self.server.db_connect
+
+    # Endpoints
+    def login(self, body):
+        res = self.db.login(self.field(body, "username"), self.field(body, "password"))
+        if not res:
+            raise HTTPError(401, "username and password are wrong.")
+
+        user_id, salt = res
+        names_encrypted = self.db.names_encrypted(user_id)
+        return 200, {"token": self.server.sessions.new(user_id, salt, names_encrypted)}
+
+    def unlock(self, body):
+        session = self.session()
+        session.data_key = unlock_secrets(
+            self.db, session.user_id, session.salt, self.field(body, "password"), cache=False
+        )
+        if session.names_encrypted:
+            session.index = BlindIndex(session.data_key)
+        return 200, {"unlocked": True}
+
+    def lock(self, body):
+        session = self.session()
+        session.data_key = None
+        session.index = None
+        return 200, {"unlocked": False}
+
+    def logout(self, body):
+        self.session()
+        self.server.sessions.drop(self.token())
+        return 200, {}
+
+    def metrics(self, body):
+        if not instrument.enabled:
+            raise HTTPError(404, "Metrics are off, set VAULT_METRICS=1")
+        return 200, instrument.metrics.prometheus()
+
+    def list_apps(self, body):
+        session = self.app_session()
+
+        if "search" in self.query:
+            rows = self.db.search(session.user_id, self.query["search"], 
+                self.query.get("prefix") == "1", index=session.index)
+        else:
+            try:
+                rows = self.db.select(cols=['id', 'app', 'username'], 
+                    conds={'user_id': session.user_id}, index=session.index)
+            except NoResultFound:
+                rows = []
+
+        return 200, [{"id": app_id, "app": app, "username": username} for app_id, app, username in rows]
+
+    def find_app(self, session, app, cols):
+        '''
+            The only row of the app, or 409 with the candidates
+        '''
+        conds = {'user_id': session.user_id, 'app': app}
+        if "username" in self.query:
+            conds['username'] = self.query["username"]
+
+        rows = self.db.select(cols=['id', 'username'] + cols, conds=conds, index=session.index)
+        if len(rows) > 1:
+            raise HTTPError(409, [{"id": row[0], "username": row[1]} for row in rows])
+        return rows[0]
+
+    def get_app(self, app, body):
+        session = self.session(unlocked=True)
+        _, username, token, key_version = self.find_app(session, app, ['secrets', 'key_version'])
+
+        if token is None:
+            return 200, {"app": app, "username": username, "secrets": []}
+        if key_version != DATA_KEY:
+            raise HTTPError(409, "The secrets of this app use another password")
+
+        if "field" not in self.query:
+            secrets = secret_record.open_secrets(token, session.data_key)
+            return 200, {"app": app, "username": username, "secrets": secrets}
+
+        try:
+            field = int(self.query["field"])
+            if field < 1:
+                raise IndexError(field)
+            secret = secret_record.open_secrets(token, session.data_key, field - 1)
+        except (ValueError, IndexError):
+            raise HTTPError(404, f'{app} has no secret {self.query["field"]}')
+
+        return 200, {"app": app, "username": username, "secret": secret}
+
+    def encrypt_secrets(self, session, secrets):
+        if not isinstance(secrets, list) or not all(isinstance(s, str) for s in secrets):
+            raise HTTPError(400, '"secrets" must be a list of strings')
+        if len(secrets) > MAX_SECRETS:
+            raise HTTPError(400, f'You can only pick {MAX_SECRETS} secrets.')
+
+        return secret_record.seal(secrets, session.data_key)
+
+    def add_app(self, body):
+        session = self.session(unlocked=True)
+        content = {
+            'app': self.field(body, "app"),
+            'username': self.field(body, "username", required=False) or '',
+            'secrets': self.encrypt_secrets(session, body.get("secrets", [])),
+            'user_id': session.user_id,
+        }
+        self.db.insert(content, index=session.index)
+        return 201, {"app": content['app']}
+
+    def edit_app(self, app, body):
+        session = self.session(unlocked=True)
+        content = {}
+
+        for name in ('app', 'username'):
+            if body.get(name):
+                content[name] = self.field(body, name)
+        if "secrets" in body:
+            content['secrets'] = self.encrypt_secrets(session, body["secrets"])
+            content['key_version'] = DATA_KEY
+
+        if not content:
+            raise HTTPError(400, "Nothing to change.")
+
+        app_id, app, username = self.db.update_by_app(
+                session.user_id, app, content, self.query.get("username"), index=session.index)
+
+        return 200, {"id": app_id, "app": app, "username": username}
+
+    def delete_app(self, app, body):
+        session = self.app_session()
+
+        app_id, app, username = self.db.delete_by_app(
+                session.user_id, app, self.query.get("username"), index=session.index)
+
+        return 200, {"id": app_id, "app": app, "username": username}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON service of the vault")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--config", default="./files/db.ini")
+    parser.add_argument("--url", help="database url, instead of the config file")
+    args = parser.parse_args()
+
+    instrument.from_env({"http": (VaultHandler, ENDPOINTS)})
+    server = VaultService((args.host, args.port), DBConnect(args.config, url=args.url))
+    print(f'Serving on http://{args.host}:{server.server_port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_handler import DBConnect
+
+
+@pytest.fixture
+def db():
+    '''
+        DBConnect on a new database in memory
+    '''
+    DBConnect.dispose()
+    db = DBConnect(url='sqlite://')
+    yield db
+    DBConnect.dispose()
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    '''
+        DBConnect on a new SQLite file, for tests with threads
+    '''
+    DBConnect.dispose()
+    db = DBConnect(url=f'sqlite:///{tmp_path / "vault.db"}')
+    yield db
+    DBConnect.dispose()
@@ -0,0 +1,39 @@
+from sqlalchemy import event, select, func
+
+from blind_index import BlindIndex
+from db_handler import DBConnect
+from encrypt import Encrypt
+
+
+def test_plain_delete_is_one_statement(db):
+    user_id, _ = db.register("delete", "login")
+    app_id = db.insert({'app': 'a', 'username': 'me', 'secrets': None, 'user_id': user_id})
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(DBConnect.engine, "before_cursor_execute", listener)
+    try:
+        db.delete({'user_id': user_id, 'id': app_id})
+    finally:
+        event.remove(DBConnect.engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 1 and statements[0].startswith("DELETE FROM vault")
+
+
+def test_delete_with_index_drops_the_grams(db):
+    user_id, _ = db.register("delete", "login")
+    index = BlindIndex(Encrypt.gen_random_key())
+    first = db.insert({'app': 'github', 'username': 'me', 'secrets': None, 'user_id': user_id}, index=index)
+    second = db.insert({'app': 'github', 'username': 'you', 'secrets': None, 'user_id': user_id}, index=index)
+
+    def grams():
+        with DBConnect.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(db.gram)).scalar()
+
+    count = grams()
+    db.delete({'user_id': user_id, 'id': first}, index=index)
+    # still used by the other row
+    assert grams() == count
+
+    db.delete({'user_id': user_id, 'id': second}, index=index)
+    assert grams() == 0
@@ -0,0 +1,44 @@
+import io
+from struct import pack
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from encrypt import Encrypt, EncryptedReader, EncryptedWriter, FILE_MAGIC
+
+HEADER_SIZE = len(FILE_MAGIC) + 5 + 7
+
+
+def encrypted(data, key, chunk_size=16):
+    out = io.BytesIO()
+    with EncryptedWriter(out, key, chunk_size) as writer:
+        writer.write(data)
+    return bytearray(out.getvalue())
+
+
+def read(stream, key):
+    return io.BufferedReader(EncryptedReader(io.BufferedReader(io.BytesIO(bytes(stream))), key)).read()
+
+
+def test_round_trip():
+    key = Encrypt.gen_random_key()
+    data = bytes(range(256)) * 3
+    assert read(encrypted(data, key), key) == data
+
+
+def test_segment_length_is_checked_before_reading():
+    key = Encrypt.gen_random_key()
+    stream = encrypted(b'x' * 100, key)
+    stream[HEADER_SIZE:HEADER_SIZE + 4] = pack(">I", 0xFFFFFFF0)
+
+    with pytest.raises(InvalidToken):
+        read(stream, key)
+
+
+def test_chunk_size_of_the_header_is_checked():
+    key = Encrypt.gen_random_key()
+    stream = encrypted(b'x' * 100, key)
+    stream[len(FILE_MAGIC) + 1:len(FILE_MAGIC) + 5] = pack(">I", 0xFFFFFFF0)
+
+    with pytest.raises(InvalidToken):
+        read(stream, key)
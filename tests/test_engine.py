@@ -0,0 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_threads_on_memory_database(db):
+    '''
+        Threads take turns on the single in memory connection
+    '''
+    user_ids = [db.register(f'thread{n}', 'login')[0] for n in range(8)]
+
+    def work(user_id):
+        for n in range(100):
+            db.insert_many([
+                {'app': f'app{n}', 'username': 'me', 'secrets': b'x' * 1000, 'user_id': user_id},
+                {'app': f'other{n}', 'username': 'me', 'secrets': None, 'user_id': user_id},
+            ])
+            db.update_by_app(user_id, f'app{n}', {'username': 'you'})
+        return len(db.select(cols=['id'], conds={'user_id': user_id, 'username': 'you'}))
+
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(work, user_ids)) == [100] * 8
@@ -0,0 +1,40 @@
+import io
+import json
+
+import pytest
+
+from encrypt import Encrypt
+from importer import Importer, iter_json_array
+import secret_record
+
+ROWS = [
+    {'app': f'app{i}', 'username': 'me', 'secrets': ['a,b', 'c"]'], 'note': [1.25, -3e10, None, True]}
+    for i in range(20)
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 1 << 16])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_json_array_is_read_in_chunks(chunk_size, indent):
+    text = json.dumps(ROWS + [12345, "s", []], indent=indent)
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ["", "{}", "[1 2]", '[{"a": 1}', "[1,"])
+def test_json_array_errors(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), 3))
+
+
+def test_import_json(db, tmp_path):
+    user_id, _ = db.register("importer", "login")
+    key = Encrypt.gen_random_key()
+    path = tmp_path / "apps.json"
+    path.write_text(json.dumps(ROWS))
+
+    rows, _ = Importer(db, user_id, key, batch_size=7).run(str(path))
+    assert rows == len(ROWS)
+
+    saved = dict(db.select(cols=['app', 'secrets'], conds={'user_id': user_id}))
+    assert sorted(saved) == sorted(row['app'] for row in ROWS)
+    assert secret_record.open_secrets(bytes(saved['app0']), key) == ['a,b', 'c"]']
@@ -0,0 +1,45 @@
+from itertools import islice
+
+import pytest
+
+NAMES = ['Zeta', 'Éclair', 'Éclair', 'Ésprit', 'éa', 'ö1', 'Ö2', 'Über']
+
+
+@pytest.fixture
+def user_id(db):
+    user_id, _ = db.register("pages", "login")
+    db.insert_many([
+        {'app': app, 'username': 'me', 'secrets': None, 'user_id': user_id}
+        for app in NAMES
+    ])
+    return user_id
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 8, 50])
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_keep_every_row(db, user_id, size, descending):
+    # a wrong key can go back to an earlier page forever
+    pages = list(islice(db.pages(user_id, size=size, descending=descending), len(NAMES) + 1))
+    rows = [row for page in pages for row in page]
+
+    assert sorted(app for _, app, _ in rows) == sorted(NAMES)
+    assert len({app_id for app_id, _, _ in rows}) == len(NAMES)
+    assert all(len(page) <= size for page in pages)
+
+
+def test_pages_by_id(db, user_id):
+    rows = [row for page in db.pages(user_id, size=3, order='id') for row in page]
+    assert [app for _, app, _ in rows] == NAMES
+
+
+def test_app_filter_lowers_like_the_database(db, user_id):
+    found = db.search(user_id, 'Éc', prefix=True)
+    assert [app for _, app, _ in found] == ['Éclair', 'Éclair']
+
+    rows, _ = db.list_page(user_id, app='Éc', size=50)
+    assert [app for _, app, _ in rows] == ['Éclair', 'Éclair']
+
+    rows = db.select(cols=['app'], conds={'user_id': user_id, 'app': 'ZETA'}, ignore_case=True)
+    assert [row[0] for row in rows] == ['Zeta']
+    rows = db.select(cols=['app'], conds={'user_id': user_id, 'app': 'ÉSPRIT'}, ignore_case=True)
+    assert [row[0] for row in rows] == ['Ésprit']
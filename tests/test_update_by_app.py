@@ -0,0 +1,19 @@
+import pytest
+
+from blind_index import BlindIndex
+from encrypt import Encrypt
+
+
+@pytest.mark.parametrize("encrypted", [False, True])
+def test_update_by_app_returns_the_updated_row(db, encrypted):
+    user_id, _ = db.register("update", "login")
+    index = BlindIndex(Encrypt.gen_random_key()) if encrypted else None
+    app_id = db.insert({'app': 'a', 'username': 'me', 'secrets': None, 'user_id': user_id}, index=index)
+
+    row = db.update_by_app(user_id, 'a', {'username': 'you'}, index=index)
+    assert tuple(row) == (app_id, 'a', 'you')
+
+    row = db.update_by_app(user_id, 'a', {'app': 'b'}, index=index)
+    assert tuple(row) == (app_id, 'b', 'you')
+
+    assert tuple(db.delete_by_app(user_id, 'b', index=index)) == (app_id, 'b', 'you')
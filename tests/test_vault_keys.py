@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from encrypt import Encrypt
+import secret_record
+from vault_keys import unlock_secrets, OLD_KEY, DATA_KEY
+
+
+def old_account(db, password):
+    '''
+        Account from before the data key, with two rows
+        encrypted straight with the password key
+    '''
+    user_id, salt = db.register("old", "login")
+    password_key = Encrypt.get_hash(password, salt)
+
+    db.insert_many([
+        {'app': app, 'username': 'me', 'user_id': user_id, 'key_version': OLD_KEY,
+            'secrets': Encrypt.encrypt(b'one,two', password_key)}
+        for app in ('a', 'b')
+    ])
+    return user_id, salt
+
+
+def key_versions(db, user_id):
+    return [row[0] for row in db.select(cols=['key_version'], conds={'user_id': user_id})]
+
+
+def test_wrong_password_on_first_unlock(db):
+    user_id, salt = old_account(db, "s2")
+
+    with pytest.raises(InvalidToken):
+        unlock_secrets(db, user_id, salt, "s2-typo", cache=False)
+
+    assert db.get_wrapped_key(user_id) is None
+    assert key_versions(db, user_id) == [OLD_KEY, OLD_KEY]
+
+    # the right password still unlocks and moves the rows
+    unlock_secrets(db, user_id, salt, "s2", cache=False)
+    assert key_versions(db, user_id) == [DATA_KEY, DATA_KEY]
+
+
+def test_first_unlock_without_old_rows(db):
+    user_id, salt = db.register("new", "login")
+
+    data_key = unlock_secrets(db, user_id, salt, "s2", cache=False)
+    assert unlock_secrets(db, user_id, salt, "s2", cache=False) == data_key
+
+    with pytest.raises(InvalidToken):
+        unlock_secrets(db, user_id, salt, "other", cache=False)
+
+
+@pytest.mark.parametrize("trial", range(5))
+def test_concurrent_first_unlock(file_db, trial):
+    db = file_db
+    user_id, salt = old_account(db, "s2")
+    barrier = Barrier(4)
+
+    def unlock(_):
+        barrier.wait()
+        return unlock_secrets(db, user_id, salt, "s2", cache=False)
+
+    with ThreadPoolExecutor(4) as pool:
+        keys = set(pool.map(unlock, range(4)))
+
+    # every caller has the key that was saved
+    assert len(keys) == 1
+    data_key = keys.pop()
+    assert Encrypt.unwrap_key(db.get_wrapped_key(user_id), Encrypt.get_hash("s2", salt)) == data_key
+
+    rows = db.select(cols=['secrets', 'key_version'], conds={'user_id': user_id})
+    assert [version for _, version in rows] == [DATA_KEY, DATA_KEY]
+    assert all(secret_record.open_secrets(bytes(secrets), data_key) == ['one', 'two'] for secrets, _ in rows)
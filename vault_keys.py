@@ -0,0 +1,124 @@
+'''
+    Key hierarchy of the secrets
+
+    Each account has a random data key that encrypts the secrets.
+    The data key is saved on the account wrapped (encrypted) with
+    the key derived from the secret password, so changing the 
+    password only rewrites the wrapped key.
+
+    Rows from before the data key (key_version 0) are encrypted 
+    straight with the password key, they are moved to the data
+    key in batches the first time the secrets are unlocked.
+'''
+from encrypt import Encrypt
+import secret_record
+
+OLD_KEY = 0
+DATA_KEY = 1
+
+
+def unlock_secrets(db_connect, user_id, salt, password, batch_size=500, cache=True):
+    '''
+        Returns the data key of the user and caches it
+        (cache=False when the caller keeps the key itself)
+        The data key is created on the first unlock, after the
+        password is checked on the old rows if there are any.
+        When first unlocks race, the key saved first is used
+        by all of them
+        Raises InvalidToken if the password is wrong
+    '''
+    wrapped_key = db_connect.get_wrapped_key(user_id)
+    password_key = Encrypt.get_hash(password, salt)
+
+    if wrapped_key is None:
+        # the data key is wrapped with this password from now on
+        check_old_password(db_connect, user_id, password_key, batch_size)
+        data_key = Encrypt.gen_random_key()
+        wrapped_key = Encrypt.wrap_key(data_key, password_key)
+
+        if not db_connect.set_wrapped_key(user_id, wrapped_key, only_new=True):
+            # another unlock saved its key first
+            wrapped_key = db_connect.get_wrapped_key(user_id)
+            data_key = Encrypt.unwrap_key(wrapped_key, password_key)
+    else:
+        data_key = Encrypt.unwrap_key(wrapped_key, password_key)
+
+    if cache:
+        Encrypt.key_cache.put(user_id, salt, data_key)
+    migrate_rows(db_connect, user_id, password_key, data_key, batch_size)
+
+    return data_key
+
+
+def check_old_password(db_connect, user_id, password_key, batch_size=500):
+    '''
+        Tries the password on the first old row with secrets
+        before a data key is made for it
+        Raises InvalidToken if the password is wrong
+        Accounts without old rows take any password
+    '''
+    last_id = 0
+
+    while True:
+        rows = db_connect.old_key_rows(user_id, last_id, batch_size)
+        if not rows:
+            return
+
+        for row_id, secrets in rows:
+            if secrets is not None:
+                Encrypt.decrypt(bytes(secrets), password_key)
+                return
+
+        last_id = rows[-1][0]
+
+
+def migrate_rows(db_connect, user_id, password_key, data_key, batch_size=500):
+    '''
+        Re-encrypts the old rows with the data key, a batch 
+        per transaction. Rows made with another password 
+        are left as they are.
+        Returns the number of rows moved
+    '''
+    # cryptography is imported on first use, like in encrypt
+    from cryptography.fernet import InvalidToken
+
+    old_cipher = Encrypt.cipher(password_key)
+    last_id = 0
+    total = 0
+
+    while True:
+        rows = db_connect.old_key_rows(user_id, last_id, batch_size)
+        if not rows:
+            break
+
+        last_id = rows[-1][0]
+        moved = []
+
+        for row_id, secrets in rows:
+            if secrets is None:
+                moved.append((row_id, None, DATA_KEY))
+                continue
+
+            try:
+                data = old_cipher.decrypt(bytes(secrets))
+            except InvalidToken:
+                continue
+
+            # written as a record of the secrets
+            secrets = data.decode("utf-8").split(",")
+            moved.append((row_id, secret_record.seal(secrets, data_key), DATA_KEY))
+
+        total += db_connect.update_secrets(user_id, moved)
+
+    return total
+
+
+def change_secret_password(db_connect, user_id, salt, old_password, new_password):
+    '''
+        Wraps the data key with the new password
+        Raises InvalidToken if the old password is wrong
+    '''
+    data_key = unlock_secrets(db_connect, user_id, salt, old_password)
+    new_key = Encrypt.get_hash(new_password, salt)
+    db_connect.set_wrapped_key(user_id, Encrypt.wrap_key(data_key, new_key))
+    return data_key